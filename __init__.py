@@ -1,4 +1,29 @@
 __author__ = 'Fabian Sinz'
 
-from .plotting import *
+import importlib
+
 from .spikes import *
+
+# the public names of the plotting module, resolved by __getattr__ on first access
+_PLOTTING_NAMES = ('box_off', 'label_axes', 'set_boxplot_colors', 'set_ticklabel_rotation', 'set_axis_fontsize',
+                   'figure_style', 'style_figure', 'hinton', 'violinplot', 'raster', 'render_batch', 'FigureSpec',
+                   'RenderResult')
+
+# from pyminions import * exports the plotting functions as before, which imports matplotlib
+__all__ = sorted(name for name in globals() if not name.startswith('_') and name != 'importlib') + \
+          ['plotting'] + list(_PLOTTING_NAMES)
+
+
+def __getattr__(name):
+    """
+    Imports the plotting module (and with it matplotlib) only when it or one of its functions is first accessed,
+    so that code that only uses the numeric functions does not pay for the matplotlib import.
+    """
+    if name != 'plotting' and name not in _PLOTTING_NAMES:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    plotting = importlib.import_module('.plotting', __name__)
+    return plotting if name == 'plotting' else getattr(plotting, name)
+
+
+def __dir__():
+    return sorted(set(globals()) | {'plotting'} | set(_PLOTTING_NAMES))
@@ -0,0 +1,21 @@
+"""
+Import time of the package in a fresh interpreter. The numeric part must not import matplotlib; budget holds the
+maximal accepted time in seconds, run.py reports benchmarks that exceed it.
+"""
+import os
+import subprocess
+import sys
+
+
+def _import(statement):
+    subprocess.check_call([sys.executable, '-c', statement], env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+
+
+class Import(object):
+    budget = {'time_import_pyminions': 1.0}
+
+    def time_import_pyminions(self):
+        _import("import sys, pyminions; assert 'matplotlib' not in sys.modules")
+
+    def time_import_plotting(self):
+        _import("import pyminions.plotting")
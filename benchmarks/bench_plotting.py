@@ -0,0 +1,57 @@
+"""
+Benchmarks of the plotting hot paths, rendered with the Agg backend.
+"""
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+from pyminions import plotting
+
+
+class Hinton(object):
+    params = [[10, 100, 300]]
+    param_names = ['size']
+
+    def setup(self, size):
+        rng = np.random.default_rng(0)
+        self.mu = rng.normal(size=(size, size))
+        self.sigma = rng.random((size, size))
+
+    def teardown(self, size):
+        plt.close('all')
+
+    def time_hinton(self, size):
+        fig, ax = plt.subplots()
+        plotting.hinton(ax, self.mu, self.sigma)
+        fig.canvas.draw()
+        plt.close(fig)
+
+    def peakmem_hinton(self, size):
+        fig, ax = plt.subplots()
+        plotting.hinton(ax, self.mu, self.sigma)
+        fig.canvas.draw()
+        plt.close(fig)
+
+
+class Violinplot(object):
+    params = [[100, 10000, 1000000]]
+    param_names = ['n_points']
+
+    def setup(self, n_points):
+        rng = np.random.default_rng(0)
+        self.data = [rng.normal(size=n_points), rng.normal(1, 2, size=n_points)]
+
+    def teardown(self, n_points):
+        plt.close('all')
+
+    def time_violinplot(self, n_points):
+        fig, ax = plt.subplots()
+        plotting.violinplot(ax, [0, 1], self.data, 0.2)
+        fig.canvas.draw()
+        plt.close(fig)
+
+    def peakmem_violinplot(self, n_points):
+        fig, ax = plt.subplots()
+        plotting.violinplot(ax, [0, 1], self.data, 0.2)
+        fig.canvas.draw()
+        plt.close(fig)
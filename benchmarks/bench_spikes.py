@@ -0,0 +1,164 @@
+"""
+Benchmarks of the spikes hot paths. The classes follow the asv conventions: params/param_names define the parameter
+grid, setup is called before the measurements, time_* methods are timed and peakmem_* methods are measured for their
+peak memory.
+"""
+import os
+import shutil
+import tempfile
+import numpy as np
+from pyminions import spikes
+from synthetic import poisson_spike_trains
+
+SAMPLE_RATE = 20000.
+
+
+class GaussKernel(object):
+    params = [[0.001, 0.01, 0.1]]
+    param_names = ['sigma']
+
+    def time_gauss_kernel(self, sigma):
+        spikes.gauss_kernel(sigma, SAMPLE_RATE, 8 * sigma)
+
+    def peakmem_gauss_kernel(self, sigma):
+        spikes.gauss_kernel(sigma, SAMPLE_RATE, 8 * sigma)
+
+
+class SpikeTimesToBinary(object):
+    params = [[10., 600.], [10., 100.]]
+    param_names = ['duration', 'rate']
+
+    def setup(self, duration, rate):
+        self.spike_times = poisson_spike_trains(rate, duration, 1)[0]
+
+    def time_spike_times_to_binary(self, duration, rate):
+        spikes.spike_times_to_binary(self.spike_times, SAMPLE_RATE, duration)
+
+    def peakmem_spike_times_to_binary(self, duration, rate):
+        spikes.spike_times_to_binary(self.spike_times, SAMPLE_RATE, duration)
+
+
+class BinarySpikeTrainToRate(object):
+    params = [[10., 600.], [1, 50]]
+    param_names = ['duration', 'n_trials']
+
+    def setup(self, duration, n_trials):
+        trains = poisson_spike_trains(20., duration / n_trials, n_trials)
+        self.binary = np.array([spikes.spike_times_to_binary(t, SAMPLE_RATE, duration / n_trials) for t in trains])
+
+    def time_binary_spike_train_to_rate(self, duration, n_trials):
+        spikes.binary_spike_train_to_rate(self.binary, SAMPLE_RATE, 0.01)
+
+    def peakmem_binary_spike_train_to_rate(self, duration, n_trials):
+        spikes.binary_spike_train_to_rate(self.binary, SAMPLE_RATE, 0.01)
+
+
+class SerialCorrelation(object):
+    params = [[1000, 100000], [10, 50]]
+    param_names = ['n_spikes', 'max_lags']
+
+    def setup(self, n_spikes, max_lags):
+        self.spike_times = np.cumsum(np.random.default_rng(0).exponential(0.05, n_spikes))
+
+    def time_serial_correlation(self, n_spikes, max_lags):
+        spikes.serial_correlation(self.spike_times, max_lags)
+
+    def peakmem_serial_correlation(self, n_spikes, max_lags):
+        spikes.serial_correlation(self.spike_times, max_lags)
+
+
+class PeakMemoryBounds(object):
+    """
+    Peak memory of the float32 paths with preallocated outputs, checked against the bounds documented in the
+    docstrings (FFT blocks, kernel value blocks and interval buffers). setup fills the kernel caches so that only the
+    temporaries of the calls are measured.
+    """
+    budget = {'peakmem_binary_spike_train_to_rate': 5 * 2 ** 20 * 4,
+              'peakmem_spike_times_to_rate': 2 ** 20 * (24 + 4) + 40 * 12000,
+              'peakmem_serial_correlation': 10 ** 6 * (32 + 2 * 4)}
+
+    def setup(self):
+        self.trains = poisson_spike_trains(20., 12., 50)
+        self.binary = spikes.spike_times_to_binary(self.trains, SAMPLE_RATE, 12., output='bool')
+        self.out = np.empty(self.binary.shape, dtype=np.float32)
+        self.spike_times = np.cumsum(np.random.default_rng(0).exponential(0.05, 10 ** 6))
+        spikes.binary_spike_train_to_rate(self.binary, SAMPLE_RATE, 0.01, out=self.out)
+
+    def peakmem_binary_spike_train_to_rate(self):
+        spikes.binary_spike_train_to_rate(self.binary, SAMPLE_RATE, 0.01, out=self.out)
+
+    def peakmem_spike_times_to_rate(self):
+        spikes.spike_times_to_rate(self.trains, SAMPLE_RATE, 12., 0.01, out=self.out)
+
+    def peakmem_serial_correlation(self):
+        spikes.serial_correlation(self.spike_times, 10, dtype=np.float32)
+
+
+class BinaryFileToRate(object):
+    """
+    Out-of-core conversion of a one hour recording stored as uint8 .npy file. Peak memory is bounded by a few
+    FFT blocks and must not grow with the duration.
+    """
+    budget = {'peakmem_binary_file_to_rate': 5 * (2 ** 20 + 2 ** 14) * 4}
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp(prefix='pyminions-bench-')
+        self.path = os.path.join(self.directory, 'binary.npy')
+        trains = poisson_spike_trains(20., 3600., 1)
+        np.save(self.path, spikes.spike_times_to_binary(trains[0], SAMPLE_RATE, 3600., output='uint8'))
+        spikes.get_kernel_fft('gaussian', 0.01, SAMPLE_RATE, 2 ** 20, dtype=np.complex64)
+
+    def teardown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def time_binary_file_to_rate(self):
+        spikes.binary_file_to_rate(self.path, SAMPLE_RATE, 0.01, os.path.join(self.directory, 'rate.npy'),
+                                   dtype=np.float32)
+
+    def peakmem_binary_file_to_rate(self):
+        spikes.binary_file_to_rate(self.path, SAMPLE_RATE, 0.01, os.path.join(self.directory, 'rate.npy'),
+                                   dtype=np.float32)
+
+
+class SpikeDistanceMatrix(object):
+    params = [['van_rossum', 'victor_purpura'], [100, 300]]
+    param_names = ['metric', 'n_trains']
+
+    def setup(self, metric, n_trains):
+        self.trains = poisson_spike_trains(20., 2.5, n_trains)
+
+    def time_spike_distance_matrix(self, metric, n_trains):
+        spikes.spike_distance_matrix(self.trains, metric, tau=0.01, cost=10.)
+
+
+class InstrumentationOverhead(object):
+    """
+    Cost of 1000 calls of an instrumented function on a tiny input without an active profile.
+    """
+
+    def setup(self):
+        self.spike_times = np.array([0.001, 0.002])
+
+    def time_disabled_instrumentation(self):
+        for _ in range(1000):
+            spikes.spike_times_to_binary(self.spike_times, 1000., 0.01)
+
+
+class ResultCache(object):
+    """
+    Lookup of a cached rate of 50 one-minute trials, dominated by hashing the input.
+    """
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp(prefix='pyminions-bench-')
+        trains = poisson_spike_trains(20., 60., 50)
+        self.binary = spikes.spike_times_to_binary(trains, SAMPLE_RATE, 60., output='bool')
+        spikes.enable_result_cache(self.directory)
+        spikes.binary_spike_train_to_rate(self.binary, SAMPLE_RATE, 0.01)
+
+    def teardown(self):
+        spikes.disable_result_cache()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def time_cache_hit(self):
+        spikes.binary_spike_train_to_rate(self.binary, SAMPLE_RATE, 0.01)
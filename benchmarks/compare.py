@@ -0,0 +1,85 @@
+"""
+Compares the benchmark results of two commits.
+
+    python benchmarks/compare.py BASE [HEAD] [--filter PATTERN] [--repeat N] [--quick] [--threshold 1.1]
+
+Both commits are checked out into temporary git worktrees and benchmarked with the benchmarks of the current
+checkout, so both sides run the same benchmark code. HEAD defaults to the working tree. Benchmarks whose ratio
+HEAD / BASE exceeds the threshold, that fail on HEAD or that exceed their budget on HEAD are marked as regressions
+and make the script exit with status 1. Benchmarks that only fail on BASE are new and are not compared.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+
+def _checkout(commit, directory):
+    path = os.path.join(directory, commit.replace('/', '_'))
+    subprocess.check_call(['git', '-C', ROOT, 'worktree', 'add', '--detach', path, commit],
+                          stdout=subprocess.DEVNULL)
+    return path
+
+
+def _run(tree, output, options):
+    subprocess.call([sys.executable, os.path.join(HERE, 'run.py'), '--tree', tree, '--output', output] + options)
+    with open(output) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base', help='commit to compare against')
+    parser.add_argument('head', nargs='?', help='commit to compare (default: the working tree)')
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this string')
+    parser.add_argument('--repeat', type=int, default=3, help='number of repetitions of timing benchmarks')
+    parser.add_argument('--quick', action='store_true', help='only run the first value of every parameter')
+    parser.add_argument('--threshold', type=float, default=1.1, help='ratio above which a change is a regression')
+    args = parser.parse_args()
+
+    options = ['--repeat', str(args.repeat)] + (['--quick'] if args.quick else [])
+    if args.filter:
+        options += ['--filter', args.filter]
+
+    directory = tempfile.mkdtemp(prefix='pyminions-compare-')
+    trees = []
+    try:
+        trees.append(_checkout(args.base, directory))
+        trees.append(_checkout(args.head, directory) if args.head else ROOT)
+        base = _run(trees[0], os.path.join(directory, 'base.json'), options)
+        head = _run(trees[1], os.path.join(directory, 'head.json'), options)
+    finally:
+        for tree in trees:
+            if tree != ROOT:
+                subprocess.call(['git', '-C', ROOT, 'worktree', 'remove', '--force', tree])
+        shutil.rmtree(directory, ignore_errors=True)
+
+    regressions = 0
+    print('\n%-90s %12s %12s %8s' % ('benchmark', 'base', 'head', 'ratio'))
+    for name in sorted(set(base) | set(head)):
+        old, new = base.get(name, {}).get('value'), head.get(name, {}).get('value')
+        ratio = new / old if new is not None and old else float('inf')
+        failed = new is None or 'error' in head.get(name, {})
+        if old is None and not failed:
+            mark = '  new'
+        elif failed or ratio > args.threshold:
+            mark = '  regression'
+            regressions += 1
+        else:
+            mark = ''
+        print('%-90s %12s %12s %8s%s' % (name, 'failed' if old is None else '%.4g' % old,
+                                         'failed' if new is None else '%.4g' % new,
+                                         'n/a' if old is None or new is None else '%.2f' % ratio, mark))
+        if failed and name in head:
+            print('    %s' % head[name].get('error', 'missing'))
+    return int(regressions > 0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+Runs the benchmark suite offline and writes the results as JSON.
+
+    python benchmarks/run.py [--tree PATH] [--output FILE] [--filter PATTERN] [--repeat N] [--quick]
+
+The package is imported from --tree (default: the checkout containing this script). For every benchmark class in
+the bench_*.py modules and every parameter combination, time_* methods are run repeat times and the best wall time
+is recorded, peakmem_* methods are run once under tracemalloc and their peak memory is recorded. Benchmarks that
+fail (e.g. because a function does not exist in the benchmarked tree) or exceed their budget are recorded with their
+error and make the script exit with status 1.
+"""
+import argparse
+import glob
+import importlib
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _link_package(tree):
+    """
+    Makes the tree importable as pyminions, independent of the name of its directory.
+    """
+    directory = tempfile.mkdtemp(prefix='pyminions-bench-')
+    os.symlink(os.path.abspath(tree), os.path.join(directory, 'pyminions'))
+    sys.path.insert(0, directory)
+    sys.path.insert(0, HERE)
+
+
+def _benchmark_classes(pattern):
+    for path in sorted(glob.glob(os.path.join(HERE, 'bench_*.py'))):
+        module = importlib.import_module(os.path.splitext(os.path.basename(path))[0])
+        for name, cls in sorted(vars(module).items()):
+            if isinstance(cls, type) and cls.__module__ == module.__name__:
+                methods = [m for m in sorted(vars(cls)) if m.startswith(('time_', 'peakmem_'))]
+                for method in methods:
+                    key = '%s.%s.%s' % (module.__name__, name, method)
+                    if pattern is None or pattern in key:
+                        yield key, cls, method
+
+
+def _parameter_grid(cls, quick):
+    params = getattr(cls, 'params', [])
+    if params and not isinstance(params[0], (list, tuple)):
+        params = [params]
+    if quick:
+        params = [p[:1] for p in params]
+    return list(itertools.product(*params))
+
+
+def _measure(cls, method, args, repeat):
+    instance = cls()
+    if hasattr(instance, 'setup'):
+        instance.setup(*args)
+    try:
+        function = getattr(instance, method)
+        if method.startswith('time_'):
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                function(*args)
+                best = min(best, time.perf_counter() - start)
+            return best
+        tracemalloc.start()
+        try:
+            function(*args)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    finally:
+        if hasattr(instance, 'teardown'):
+            instance.teardown(*args)
+
+
+def run(pattern=None, repeat=3, quick=False):
+    """
+    :return: dict mapping benchmark name and parameters to a dict with the value (seconds or bytes), the unit and,
+             if the benchmark failed, the error
+    """
+    results = {}
+    try:
+        benchmarks = list(_benchmark_classes(pattern))
+    except Exception as e:
+        return {'import': {'value': None, 'unit': None, 'error': repr(e)}}
+    for key, cls, method in benchmarks:
+        budget = getattr(cls, 'budget', {}).get(method)
+        for args in _parameter_grid(cls, quick):
+            name = key if not args else '%s(%s)' % (key, ', '.join(repr(a) for a in args))
+            unit = 's' if method.startswith('time_') else 'bytes'
+            try:
+                value = _measure(cls, method, args, repeat)
+                results[name] = {'value': value, 'unit': unit}
+                if budget is not None and value > budget:
+                    results[name]['error'] = 'over budget of %g %s' % (budget, unit)
+            except Exception as e:
+                results[name] = {'value': None, 'unit': unit, 'error': repr(e)}
+            print('%-90s %s' % (name, _format(results[name])))
+    return results
+
+
+def _format(result):
+    if result['value'] is None:
+        return 'failed: ' + result['error']
+    if result['unit'] == 's':
+        text = '%10.4f ms' % (result['value'] * 1e3)
+    else:
+        text = '%10.2f MB' % (result['value'] / 2. ** 20)
+    return text if 'error' not in result else text + '  ' + result['error']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tree', default=os.path.dirname(HERE), help='source tree of the package to benchmark')
+    parser.add_argument('--output', help='JSON file the results are written to')
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this string')
+    parser.add_argument('--repeat', type=int, default=3, help='number of repetitions of timing benchmarks')
+    parser.add_argument('--quick', action='store_true', help='only run the first value of every parameter')
+    args = parser.parse_args()
+
+    _link_package(args.tree)
+    results = run(args.filter, args.repeat, args.quick)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    return int(any('error' in r for r in results.values()))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
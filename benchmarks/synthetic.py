@@ -0,0 +1,21 @@
+import numpy as np
+
+
+def poisson_spike_train(rate, duration, rng):
+    """
+    Homogeneous Poisson spike train.
+
+    :param rate: firing rate in Hz
+    :param duration: duration in seconds
+    :param rng: numpy random Generator
+    :return: sorted spike times in seconds
+    """
+    return np.sort(rng.uniform(0, duration, rng.poisson(rate * duration)))
+
+
+def poisson_spike_trains(rate, duration, n_trials, seed=0):
+    """
+    :return: list of n_trials independent Poisson spike trains, reproducible for a given seed
+    """
+    rng = np.random.default_rng(seed)
+    return [poisson_spike_train(rate, duration, rng) for _ in range(n_trials)]
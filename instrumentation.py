@@ -0,0 +1,191 @@
+"""
+Opt-in instrumentation of the public functions of pyminions.
+
+Functions decorated with instrument record their number of calls, cumulative wall time, the size of their array
+inputs and, optionally, the memory they allocate while a profile is active:
+
+>>> from pyminions import instrumentation
+>>> with instrumentation.profile(memory=True) as p:
+...     rate = spike_times_to_rate(spike_times, 20000., 600., 0.01)
+>>> print(p.summary())
+>>> p.to_json('profile.json')
+
+Alternatively the environment variable PYMINIONS_PROFILE profiles the whole process: if it is set to a file name
+ending in .json the records are written to that file at exit, otherwise the summary table is printed to stderr.
+Without an active profile an instrumented function only checks a global variable before calling the original.
+"""
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+# the active Profile or None
+_active = None
+
+
+class Profile(object):
+    """
+    Records of the instrumented calls made while the profile is active. records maps the qualified function name to
+    a dict with the number of calls, the cumulative wall time in seconds, the cumulative size of the array inputs in
+    bytes and, if memory is True, the cumulative and the largest peak memory allocated during a call in bytes. Times
+    and allocations of functions that call other instrumented functions include those calls.
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.records = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def reset(self):
+        with self._lock:
+            self.records = {}
+
+    def _add(self, name, seconds, input_bytes, allocated):
+        with self._lock:
+            record = self.records.get(name)
+            if record is None:
+                record = self.records[name] = {'calls': 0, 'seconds': 0., 'input_bytes': 0}
+                if self.memory:
+                    record.update(allocated_bytes=0, max_allocated_bytes=0)
+            record['calls'] += 1
+            record['seconds'] += seconds
+            record['input_bytes'] += input_bytes
+            if allocated is not None:
+                record['allocated_bytes'] += allocated
+                record['max_allocated_bytes'] = max(record['max_allocated_bytes'], allocated)
+
+    def _enter_memory(self):
+        """
+        Starts the peak memory measurement of a call. tracemalloc has a single peak, so the peak of the enclosing
+        calls is saved on a per thread stack before it is reset.
+        """
+        stack = self._local.__dict__.setdefault('stack', [])
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1][1] = max(stack[-1][1], peak)
+        tracemalloc.reset_peak()
+        stack.append([current, current])
+
+    def _exit_memory(self):
+        stack = self._local.stack
+        start, peak = stack.pop()
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        if stack:
+            stack[-1][1] = max(stack[-1][1], peak)
+        tracemalloc.reset_peak()
+        return peak - start
+
+    def summary(self, sort='seconds'):
+        """
+        :param sort: the column the functions are sorted by (descending)
+        :return: the records as text table
+        """
+        columns = ['calls', 'seconds', 'input_bytes'] + (['allocated_bytes', 'max_allocated_bytes']
+                                                         if self.memory else [])
+        with self._lock:
+            rows = sorted(self.records.items(), key=lambda item: -item[1][sort])
+        width = max([len(name) for name, _ in rows] + [8])
+        lines = ['%-*s %s' % (width, 'function', ' '.join('%19s' % c for c in columns))]
+        for name, record in rows:
+            lines.append('%-*s %s' % (width, name, ' '.join('%19.6f' % record[c] if c == 'seconds'
+                                                            else '%19d' % record[c] for c in columns)))
+        return '\n'.join(lines)
+
+    def to_json(self, path=None):
+        """
+        :param path: if given, the records are written to this file
+        :return: the records as JSON string
+        """
+        with self._lock:
+            text = json.dumps(self.records, indent=1, sort_keys=True)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+
+def _input_bytes(args, kwargs):
+    """
+    Size of the numpy arrays (or other objects with nbytes) among the arguments and in lists and tuples of them.
+    """
+    total = 0
+    for value in list(args) + list(kwargs.values()):
+        if isinstance(value, (list, tuple)):
+            total += sum(getattr(v, 'nbytes', 0) for v in value)
+        else:
+            nbytes = getattr(value, 'nbytes', 0)
+            total += nbytes if isinstance(nbytes, int) else 0
+    return total
+
+
+def instrument(function):
+    """
+    Decorator that records the calls of function in the active profile, if there is one.
+    """
+    name = '%s.%s' % (function.__module__, function.__qualname__)
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        profile = _active
+        if profile is None:
+            return function(*args, **kwargs)
+        input_bytes = _input_bytes(args, kwargs)
+        memory = profile.memory and tracemalloc.is_tracing()
+        if memory:
+            profile._enter_memory()
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            profile._add(name, seconds, input_bytes, profile._exit_memory() if memory else None)
+
+    return wrapper
+
+
+@contextmanager
+def profile(memory=False):
+    """
+    Context manager that activates a new profile for all instrumented functions and yields it. Profiles can be
+    nested, the inner one then receives the records until it is left.
+
+    :param memory: If true the peak memory allocated during every call is recorded with tracemalloc, which slows
+                   down numpy allocations considerably.
+    """
+    global _active
+    previous, _active = _active, Profile(memory)
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        yield _active
+    finally:
+        if started:
+            tracemalloc.stop()
+        _active = previous
+
+
+def _profile_process(target):
+    """
+    Activates a profile for the whole process that is written to target (a .json file or stderr) at exit.
+    """
+    global _active
+    _active = Profile()
+
+    def report(profile=_active):
+        if target.endswith('.json'):
+            profile.to_json(target)
+        else:
+            sys.stderr.write(profile.summary() + '\n')
+
+    atexit.register(report)
+
+
+if os.environ.get('PYMINIONS_PROFILE'):
+    _profile_process(os.environ['PYMINIONS_PROFILE'])
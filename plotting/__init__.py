@@ -1,2 +1,3 @@
 from .cosmetics import *
 from .plots import *
+from .batch import *
@@ -0,0 +1,135 @@
+import time
+import numpy as np
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+FigureSpec = namedtuple('FigureSpec', ['function', 'filename', 'args', 'kwargs', 'figsize', 'dpi', 'style'])
+FigureSpec.__new__.__defaults__ = ((), {}, (6.4, 4.8), 100, None)
+FigureSpec.__doc__ = """
+Description of one figure for render_batch. function is called as function(ax, *args, **kwargs) on a fresh axis
+(e.g. hinton, violinplot or raster) and the figure is saved to filename. style is None or a dict of keyword
+arguments for cosmetics.style_figure.
+"""
+
+RenderResult = namedtuple('RenderResult', ['filename', 'seconds', 'error'])
+
+_SharedArray = namedtuple('_SharedArray', ['name', 'shape', 'dtype'])
+
+# figure and canvas reused by all figures rendered in a worker
+_figure = None
+
+
+def _share(obj, blocks, threshold, handles):
+    """
+    Replaces numpy arrays larger than threshold bytes in obj (and in lists, tuples and dicts within it) by handles to
+    shared memory blocks holding a copy of their data. handles maps id(array) to the handle of arrays that are
+    already shared, so an array used by several specs is copied only once.
+    """
+    if isinstance(obj, np.ndarray) and obj.nbytes >= threshold and obj.dtype != object:
+        if id(obj) not in handles:
+            block = shared_memory.SharedMemory(create=True, size=obj.nbytes)
+            np.ndarray(obj.shape, obj.dtype, buffer=block.buf)[...] = obj
+            blocks.append(block)
+            handles[id(obj)] = _SharedArray(block.name, obj.shape, obj.dtype.str)
+        return handles[id(obj)]
+    if isinstance(obj, (list, tuple)) and not hasattr(obj, '_fields'):
+        return type(obj)(_share(o, blocks, threshold, handles) for o in obj)
+    if isinstance(obj, dict):
+        return {k: _share(v, blocks, threshold, handles) for k, v in obj.items()}
+    return obj
+
+
+def _attach(obj, blocks):
+    """
+    Inverse of _share: replaces shared memory handles by arrays viewing the shared memory.
+    """
+    if isinstance(obj, _SharedArray):
+        block = shared_memory.SharedMemory(name=obj.name)
+        blocks.append(block)
+        return np.ndarray(obj.shape, np.dtype(obj.dtype), buffer=block.buf)
+    if isinstance(obj, (list, tuple)) and not hasattr(obj, '_fields'):
+        return type(obj)(_attach(o, blocks) for o in obj)
+    if isinstance(obj, dict):
+        return {k: _attach(v, blocks) for k, v in obj.items()}
+    return obj
+
+
+def _render(spec):
+    global _figure
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from .cosmetics import style_figure
+
+    start = time.perf_counter()
+    blocks = []
+    args = kwargs = None
+    try:
+        if _figure is None:
+            _figure = Figure()
+            FigureCanvasAgg(_figure)
+        _figure.clf()
+        _figure.set_size_inches(spec.figsize)
+        # functions that adapt to the resolution (e.g. raster) see the pixel size of the saved figure
+        _figure.set_dpi(spec.dpi)
+        ax = _figure.add_subplot(111)
+        args, kwargs = _attach(spec.args, blocks), _attach(spec.kwargs, blocks)
+        spec.function(ax, *args, **kwargs)
+        if spec.style is not None:
+            style_figure(_figure, **spec.style)
+        _figure.savefig(spec.filename, dpi=spec.dpi)
+        error = None
+    except Exception as e:
+        error = repr(e)
+    finally:
+        del args, kwargs
+        if _figure is not None:
+            _figure.clf()
+        for block in blocks:
+            try:
+                block.close()
+            except BufferError:
+                pass  # still referenced by an artist, released when the worker exits
+    return RenderResult(spec.filename, time.perf_counter() - start, error)
+
+
+def _render_chunk(specs):
+    return [_render(spec) for spec in specs]
+
+
+def render_batch(specs, n_jobs=None, shared_memory_threshold=2 ** 20):
+    """
+    Renders a list of figures headlessly with the Agg backend, optionally in a process pool.
+
+    Every worker reuses one figure and canvas for all its figures. If a process pool is used, numpy arrays of at
+    least shared_memory_threshold bytes in the arguments of the specs are passed to the workers through shared
+    memory instead of being pickled; arrays used by several specs are copied only once. Errors in single figures do
+    not stop the batch but are reported in the result.
+
+    :param specs: list of FigureSpec
+    :param n_jobs: the number of worker processes. If None, the figures are rendered in the current process.
+    :param shared_memory_threshold: minimal size in bytes of arrays that are passed through shared memory
+
+    :return: list of RenderResult (filename, rendering time in seconds, error or None), in the order of specs
+    """
+    specs = [FigureSpec(*spec) if not isinstance(spec, FigureSpec) else spec for spec in specs]
+    if n_jobs is None or n_jobs < 2 or len(specs) < 2:
+        return _render_chunk(specs)
+
+    blocks, handles = [], {}
+    try:
+        # the specs keep the arrays alive, so their ids are not reused while sharing
+        shared = [spec._replace(args=_share(spec.args, blocks, shared_memory_threshold, handles),
+                                kwargs=_share(spec.kwargs, blocks, shared_memory_threshold, handles))
+                  for spec in specs]
+        chunks = [shared[i::n_jobs * 4] for i in range(min(len(shared), n_jobs * 4))]
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            rendered = {}
+            for chunk, results in zip(chunks, executor.map(_render_chunk, chunks)):
+                for spec, result in zip(chunk, results):
+                    rendered[id(spec)] = result
+        return [rendered[id(spec)] for spec in shared]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
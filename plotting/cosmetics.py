@@ -1,8 +1,12 @@
+from contextlib import contextmanager
 from itertools import cycle
 import string
+from ..instrumentation import instrument
+
 __author__ = 'Fabian Sinz, Jan Grewe'
 
 
+@instrument
 def box_off(ax, where=None):
     """
     Removes axes form an matplotlib axis handle. The variable where
@@ -12,7 +16,7 @@ def box_off(ax, where=None):
     :param where: list with one or more of the following elements: 'left', 'right', 'bottom', 'top' (default: ['right', 'top'])
     """
     if where is None: where = ['right', 'top']
-    for loc, spine in ax.spines.iteritems():
+    for loc, spine in ax.spines.items():
         if loc in where:
             spine.set_color('none')  # don't draw spine
         else:
@@ -21,6 +25,7 @@ def box_off(ax, where=None):
     ax.yaxis.set_ticks_position('left')
 
 
+@instrument
 def label_axes(fig, labels=None, loc=None, **kwargs):
     """
     Walks through axes and labels each.
@@ -39,7 +44,7 @@ def label_axes(fig, labels=None, loc=None, **kwargs):
 
     """
     if labels is None:
-        labels = string.lowercase
+        labels = string.ascii_lowercase
 
     # re-use labels rather than stop labeling
     labels = cycle(labels)
@@ -51,6 +56,7 @@ def label_axes(fig, labels=None, loc=None, **kwargs):
                     **kwargs)
 
 
+@instrument
 def set_boxplot_colors(boxplot, colors):
     """
 
@@ -77,6 +83,7 @@ def set_boxplot_colors(boxplot, colors):
         cap.set_color(colors[i / 2])
 
 
+@instrument
 def set_ticklabel_rotation(axis, rotation):
     """
         Rotates the tick labels of the selected axis.
@@ -93,6 +100,7 @@ def set_ticklabel_rotation(axis, rotation):
         l.set_rotation(rotation)
 
 
+@instrument
 def set_axis_fontsize(axis, label_size, tick_label_size=None, legend_size=None):
     """
         Sets axis, tick label and legend font sizes to the desired size.
@@ -109,10 +117,69 @@ def set_axis_fontsize(axis, label_size, tick_label_size=None, legend_size=None):
         legend_size = label_size
     axis.xaxis.get_label().set_fontsize(label_size)
     axis.yaxis.get_label().set_fontsize(label_size)
-    for tick in axis.xaxis.get_major_ticks() + axis.yaxis.get_major_ticks():
-        tick.label.set_fontsize(tick_label_size)
+    axis.tick_params(labelsize=tick_label_size)
 
     l = axis.get_legend()
     if l:
         for t in l.get_texts():
-            t.set_fontsize(legend_size)
\ No newline at end of file
+            t.set_fontsize(legend_size)
+
+
+@contextmanager
+def figure_style(where=None, label_size=None, tick_label_size=None, legend_size=None):
+    """
+        Context manager that applies box_off and set_axis_fontsize to all figures created inside it through
+        matplotlib's rcParams. The style is set once instead of being applied to every axis afterwards. Some
+        settings (e.g. the tick label size used to choose the number of ticks) are read when the figure is drawn,
+        so figures should also be saved inside the context. Legends created inside the context are sized for the
+        legend font size.
+
+    :param where: list of spines to remove, see box_off (default: ['right', 'top']). Pass [] to keep all.
+    :param label_size: the size of the axis labels, None leaves the current setting
+    :param tick_label_size: the size of the tick labels. If None, label_size is used
+    :param legend_size: the size of the font used in the legend. If None, label_size is used
+
+    """
+    import matplotlib
+    if where is None: where = ['right', 'top']
+    rc = {'axes.spines.' + loc: False for loc in where}
+    if 'top' in where:
+        rc.update({'xtick.top': False, 'xtick.labeltop': False, 'xtick.bottom': True, 'xtick.labelbottom': True})
+    if 'right' in where:
+        rc.update({'ytick.right': False, 'ytick.labelright': False, 'ytick.left': True, 'ytick.labelleft': True})
+    if label_size is not None:
+        rc['axes.labelsize'] = label_size
+        rc['xtick.labelsize'] = rc['ytick.labelsize'] = tick_label_size or label_size
+        rc['legend.fontsize'] = legend_size or label_size
+    with matplotlib.rc_context(rc):
+        yield
+
+
+@instrument
+def style_figure(fig, where=None, label_size=None, tick_label_size=None, legend_size=None, labels=None, loc=None,
+                 **kwargs):
+    """
+        Applies box_off, set_axis_fontsize and label_axes to all axes of an existing figure in a single pass.
+
+    :param fig: Figure object to work on
+    :param where: list of spines to remove, see box_off (default: ['right', 'top']). Pass [] to keep all.
+    :param label_size: the size of the axis labels, None leaves the font sizes unchanged
+    :param tick_label_size: the size of the tick labels. If None, label_size is used
+    :param legend_size: the size of the font used in the legend. If None, label_size is used
+    :param labels: iterable of strings to label the axes with (see label_axes), None for no labels
+    :param loc: Where to put the label in axes-fraction units
+    :param kwargs: passed to annotate for the axes labels
+
+    """
+    if where is None: where = ['right', 'top']
+    if labels is not None:
+        labels = cycle(labels)
+    if loc is None:
+        loc = (.9, .9)
+    for ax in fig.axes:
+        if where:
+            box_off(ax, where)
+        if label_size is not None:
+            set_axis_fontsize(ax, label_size, tick_label_size, legend_size)
+        if labels is not None:
+            ax.annotate(next(labels), xy=loc, xycoords='axes fraction', **kwargs)
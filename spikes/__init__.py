@@ -1 +1,8 @@
+from .kernels import *
+from .spiketrainset import *
+from .cache import *
+from .provenance import *
 from .spiketimes import *
+from .streaming import *
+from .correlograms import *
+from .distances import *
@@ -0,0 +1,331 @@
+"""
+Opt-in persistent cache of analysis results.
+
+Results of the functions decorated with cached are stored in a directory, keyed by a hash of the input arrays, the
+other parameters, the function name and its version. Repeated calls with unchanged inputs load the stored result
+as copy-on-write memory map instead of recomputing it. Like computed results they are writable; changes are not
+written back to the cache:
+
+>>> from pyminions.spikes import result_cache
+>>> with result_cache('/tmp/pyminions-cache', max_bytes=2 ** 32):
+...     rate = binary_spike_train_to_rate(binary, 20000., 0.01)
+
+The cache can also be enabled for a whole process with the environment variables PYMINIONS_CACHE (the directory)
+and PYMINIONS_CACHE_SIZE (the size limit in bytes). Several processes can share one cache directory.
+"""
+import hashlib
+import os
+import pickle
+import shutil
+import threading
+import time
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import wraps
+from inspect import signature
+import numpy as np
+from .spiketrainset import SpikeTrainSet
+
+# changes of the storage format invalidate all entries
+CACHE_FORMAT = 1
+
+# fraction of the free space of the cache a process may fill before it scans the entries again. Up to
+# 1 / RESCAN_FRACTION processes sharing a directory cannot exceed max_bytes between scans, more processes only by
+# a part of it.
+RESCAN_FRACTION = 1 / 8
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'entries', 'bytes', 'max_bytes'])
+
+# the active ResultCache or None
+_active = None
+_local = threading.local()
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+class _Stored(object):
+    """
+    Placeholder for the index-th array of a stored result.
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+
+def _update(h, value):
+    """
+    Feeds a canonical representation of value into the hash h. Raises _Uncacheable for values without one.
+    """
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        h.update(b'S%s:%r;' % (type(value).__name__.encode(), value))
+    elif isinstance(value, np.generic):
+        _update(h, value.item())
+    elif isinstance(value, np.dtype) or (isinstance(value, type) and issubclass(value, np.generic)):
+        h.update(b'D%s;' % np.dtype(value).str.encode())
+    elif isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            raise _Uncacheable()
+        h.update(b'A%s%r;' % (value.dtype.str.encode(), value.shape))
+        h.update(memoryview(np.ascontiguousarray(value)).cast('B'))
+    elif isinstance(value, SpikeTrainSet):
+        h.update(b'T;')
+        _update(h, np.asarray(value.spike_times))
+        _update(h, np.asarray(value.offsets))
+    elif hasattr(value, 'tocsr') and hasattr(value, 'nnz'):
+        csr = value.tocsr()
+        h.update(b'C%r;' % (csr.shape,))
+        for part in (csr.data, csr.indices, csr.indptr):
+            _update(h, part)
+    elif isinstance(value, (list, tuple)):
+        h.update(b'L%s%d;' % (type(value).__name__.encode(), len(value)))
+        for item in value:
+            _update(h, item)
+    else:
+        raise _Uncacheable()
+
+
+def _pack(result, arrays):
+    """
+    Replaces the arrays in result (and in tuples within it) by placeholders and collects them in arrays.
+    """
+    if isinstance(result, np.ndarray):
+        if result.dtype.hasobject:
+            raise _Uncacheable()
+        arrays.append(result)
+        return _Stored(len(arrays) - 1)
+    if isinstance(result, tuple):
+        items = [_pack(item, arrays) for item in result]
+        return type(result)(*items) if hasattr(result, '_fields') else tuple(items)
+    return result
+
+
+def _unpack(packed, path):
+    if isinstance(packed, _Stored):
+        # copy-on-write, so that hits are writable like computed results without touching the stored entry
+        return np.load(os.path.join(path, '%d.npy' % packed.index), mmap_mode='c')
+    if isinstance(packed, tuple):
+        items = [_unpack(item, path) for item in packed]
+        return type(packed)(*items) if hasattr(packed, '_fields') else tuple(items)
+    return packed
+
+
+def _size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+class ResultCache(object):
+    """
+    Size bounded cache of results in directory. Every entry is a subdirectory named by its key with the result
+    structure and its arrays as .npy files. Entries are written to a temporary directory and renamed into place,
+    so other processes see either a complete entry or none. When the entries exceed max_bytes, the least recently
+    used ones (by modification time, which is updated on every hit) are deleted.
+
+    Storing does not scan the directory every time: the entries are scanned (and evicted) again once the bytes
+    stored by this process since the last scan exceed RESCAN_FRACTION of the free space found by that scan, which
+    bounds the growth of a directory shared by several processes that do not see each other's stores.
+    """
+
+    def __init__(self, directory, max_bytes=2 ** 30):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # total size of the entries at the last scan (None before the first) and bytes stored since
+        self._scanned = None
+        self._stored = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, name, version, arguments):
+        """
+        :return: the hex digest of the function name, its version and the arguments (dict of parameter values)
+        """
+        # sha256 is hardware accelerated on current CPUs and hashes large buffers faster than blake2b
+        h = hashlib.sha256()
+        h.update(b'%d:%s:%r;' % (CACHE_FORMAT, name.encode(), version))
+        for parameter in sorted(arguments):
+            h.update(parameter.encode() + b'=')
+            _update(h, arguments[parameter])
+        return h.hexdigest()[:40]
+
+    def load(self, key):
+        """
+        :return: the stored result and True, or None and False if there is no complete entry for key
+        """
+        path = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(path, 'result.pickle'), 'rb') as f:
+                result = _unpack(pickle.load(f), path)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # missing, or deleted by another process while loading
+            self.misses += 1
+            return None, False
+        self.hits += 1
+        return result, True
+
+    def store(self, key, result):
+        """
+        Stores result under key, unless it contains values that cannot be stored, and evicts old entries.
+        """
+        arrays = []
+        try:
+            packed = _pack(result, arrays)
+        except _Uncacheable:
+            return
+        temporary = os.path.join(self.directory, '.tmp-%s-%s' % (key, uuid.uuid4().hex))
+        try:
+            os.makedirs(temporary)
+            for index, array in enumerate(arrays):
+                np.save(os.path.join(temporary, '%d.npy' % index), array)
+            with open(os.path.join(temporary, 'result.pickle'), 'wb') as f:
+                pickle.dump(packed, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = _size(temporary)
+            os.rename(temporary, os.path.join(self.directory, key))
+        except OSError:
+            # another process stored the same entry first, or the directory is not writable
+            shutil.rmtree(temporary, ignore_errors=True)
+            return
+        self._stored += size
+        if self._scanned is None or self._stored > (self.max_bytes - self._scanned) * RESCAN_FRACTION:
+            self.evict()
+
+    def _remove(self, name):
+        trash = os.path.join(self.directory, '.trash-%s' % uuid.uuid4().hex)
+        try:
+            os.rename(os.path.join(self.directory, name), trash)
+        except OSError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def _entries(self):
+        """
+        :return: list of (modification time, size, name) of the complete entries; removes temporary directories
+                 left behind by crashed processes
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.startswith('.'):
+                    if time.time() - entry.stat().st_mtime > 3600:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                elif entry.is_dir():
+                    entries.append((entry.stat().st_mtime, _size(entry.path), entry.name))
+            except OSError:
+                continue
+        return entries
+
+    def evict(self):
+        """
+        Deletes the least recently used entries until the cache holds at most max_bytes.
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(name)
+            total -= size
+        self._scanned, self._stored = total, 0
+
+    def clear(self):
+        """
+        Deletes all entries.
+        """
+        for entry in os.scandir(self.directory):
+            self._remove(entry.name)
+        self._scanned, self._stored = 0, 0
+
+    def info(self):
+        """
+        :return: CacheInfo with the hits and misses of this process and the number and size of the entries
+        """
+        entries = self._entries()
+        return CacheInfo(self.hits, self.misses, len(entries), sum(size for _, size, _ in entries), self.max_bytes)
+
+
+def cached(version, ignore=('out', 'n_jobs', 'backend'), condition=None):
+    """
+    Decorator that looks up the results of a function in the active result cache, if there is one. Calls that pass
+    an out array, that have arguments without a canonical representation or for which condition(arguments) is false
+    are not cached. Calls made while a cached function is computed, whether its result is cached or not, are not
+    cached themselves.
+
+    :param version: version of the function, to be increased whenever its results change
+    :param ignore: the parameters that do not change the result
+    :param condition: function of the dict of all arguments that returns whether the call may be cached
+    """
+    def decorator(function):
+        name = '%s.%s' % (function.__module__, function.__qualname__)
+        parameters = signature(function)
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            cache = _active
+            if cache is None or getattr(_local, 'computing', False):
+                return function(*args, **kwargs)
+            bound = parameters.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = bound.arguments
+            key = None
+            if arguments.get('out') is None and (condition is None or condition(arguments)):
+                try:
+                    key = cache.key(name, version, {p: v for p, v in arguments.items() if p not in ignore})
+                except _Uncacheable:
+                    pass
+            if key is not None:
+                result, found = cache.load(key)
+                if found:
+                    return result
+            _local.computing = True
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                _local.computing = False
+            if key is not None:
+                cache.store(key, result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def enable_result_cache(directory, max_bytes=2 ** 30):
+    """
+    Activates a result cache in directory for all cached functions.
+
+    :param directory: the cache directory, created if it does not exist
+    :param max_bytes: the maximal size of the stored results in bytes
+    :return: the ResultCache
+    """
+    global _active
+    _active = ResultCache(directory, max_bytes)
+    return _active
+
+
+def disable_result_cache():
+    """
+    Deactivates the result cache. The stored results are kept.
+    """
+    global _active
+    _active = None
+
+
+@contextmanager
+def result_cache(directory, max_bytes=2 ** 30):
+    """
+    Context manager that activates a result cache (see enable_result_cache) and yields it.
+    """
+    global _active
+    previous = _active
+    try:
+        yield enable_result_cache(directory, max_bytes)
+    finally:
+        _active = previous
+
+
+if os.environ.get('PYMINIONS_CACHE'):
+    enable_result_cache(os.environ['PYMINIONS_CACHE'], int(float(os.environ.get('PYMINIONS_CACHE_SIZE', 2 ** 30))))
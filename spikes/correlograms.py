@@ -0,0 +1,116 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations, repeat
+from .spiketrainset import SpikeTrainSet
+from .cache import cached
+
+
+def _merge_correlogram(a, b, bin_size, n_lags):
+    """
+    Histogram of the differences floor(b_j / bin_size) - floor(a_i / bin_size) of the bin indices within +-n_lags,
+    the same lag convention as _binned_block. For every spike in a, the window of spikes in b is found by binary
+    search in the sorted train b, so the cost is proportional to the number of spikes plus the number of
+    differences within the window.
+    """
+    window = (n_lags + 1) * bin_size
+    lo = np.searchsorted(b, a - window, 'left')
+    hi = np.searchsorted(b, a + window, 'right')
+    counts = hi - lo
+    total = counts.sum()
+    if total == 0:
+        return np.zeros(2 * n_lags + 1, dtype=np.int64)
+    starts = np.cumsum(counts) - counts
+    index = np.repeat(lo - starts, counts) + np.arange(total)
+    a_bins = np.floor(a / bin_size).astype(np.int64)
+    lag = np.floor(b[index] / bin_size).astype(np.int64) - np.repeat(a_bins, counts) + n_lags
+    lag = lag[(lag >= 0) & (lag <= 2 * n_lags)]
+    return np.bincount(lag, minlength=2 * n_lags + 1)
+
+
+def _merge_block(trains, pairs, bin_size, n_lags):
+    ccg = np.zeros((len(pairs), 2 * n_lags + 1), dtype=np.int64)
+    for k, (i, j) in enumerate(pairs):
+        ccg[k] = _merge_correlogram(np.asarray(trains[i]), np.asarray(trains[j]), bin_size, n_lags)
+    return ccg
+
+
+def _binned_block(counts, pairs, lags):
+    """
+    Correlogram values of the given pairs at the given non-negative lags (in bins) from products of the sparse
+    (units x bins) count matrix with a shifted copy of itself. Returns the values at +lag and at -lag.
+    """
+    n_bins = counts.shape[1]
+    positive = np.zeros((len(pairs), len(lags)), dtype=np.int64)
+    negative = np.zeros((len(pairs), len(lags)), dtype=np.int64)
+    for k, lag in enumerate(lags):
+        if lag >= n_bins:
+            continue
+        product = counts[:, :n_bins - lag] @ counts[:, lag:].T
+        product = product.toarray() if counts.shape[0] ** 2 <= 2 ** 24 else product.tocsr()
+        positive[:, k] = np.asarray(product[pairs[:, 0], pairs[:, 1]]).ravel()
+        negative[:, k] = np.asarray(product[pairs[:, 1], pairs[:, 0]]).ravel()
+    return positive, negative
+
+
+@cached(version=2)
+def cross_correlogram(spike_trains, bin_size, max_lag, pairs=None, method='auto', n_jobs=None):
+    """
+    Computes spike time cross-correlograms for pairs of spike trains, i.e. the number of spike pairs (a_i, b_j) of
+    trains a and b whose time difference falls into each lag bin. The spikes are assigned to bins of width
+    bin_size (bin floor(t / bin_size)) and lag k counts the spike pairs whose bin indices differ by k, so the time
+    differences counted at lag k lie between (k - 1) * bin_size and (k + 1) * bin_size.
+
+    Two algorithms are available, which give identical counts. 'merge' finds for every spike the spikes of the
+    other train within max_lag by binary search in the sorted train, so the cost scales with the number of spikes
+    and of coincidences, which is efficient for sparse trains and few pairs. 'binned' computes the correlogram of
+    all pairs at once from products of a sparse (trains x bins) count matrix with shifted copies of itself. 'auto'
+    uses 'binned' if all pairs are requested and 'merge' otherwise.
+
+    :param spike_trains: list of sorted 1D spike time arrays in seconds or a SpikeTrainSet
+    :param bin_size: width of the lag bins in seconds
+    :param max_lag: largest lag in seconds, the lags are -max_lag ... max_lag in steps of bin_size
+    :param pairs: (pairs x 2) array of train indices (a, b). If None, all pairs i < j are used.
+    :param method: 'merge', 'binned' or 'auto'
+    :param n_jobs: if given, the pairs ('merge') or lags ('binned') are split into blocks processed in a process pool
+
+    :return: the correlograms as (pairs x lags) array of counts, the lags in seconds and the pairs
+    """
+    trains = spike_trains if isinstance(spike_trains, SpikeTrainSet) else SpikeTrainSet.from_list(spike_trains)
+    n_lags = int(round(max_lag / float(bin_size)))
+    lags = np.arange(-n_lags, n_lags + 1) * bin_size
+    all_pairs = pairs is None
+    if all_pairs:
+        pairs = np.array(list(combinations(range(len(trains)), 2)), dtype=np.int64).reshape(-1, 2)
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    if method == 'auto':
+        method = 'binned' if all_pairs else 'merge'
+    parallel = n_jobs is not None and n_jobs > 1
+
+    if method == 'merge':
+        if not parallel or len(pairs) < 2:
+            return _merge_block(trains, pairs, bin_size, n_lags), lags, pairs
+        blocks = np.array_split(pairs, min(n_jobs, len(pairs)))
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            ccg = list(executor.map(_merge_block, repeat(trains), blocks, repeat(bin_size), repeat(n_lags)))
+        return np.concatenate(ccg), lags, pairs
+
+    if method != 'binned':
+        raise ValueError("method must be 'merge', 'binned' or 'auto'")
+    try:
+        from scipy import sparse
+    except ImportError:
+        raise ImportError("method='binned' requires scipy. Install via pip (pip install scipy).")
+    bins = np.floor(np.asarray(trains.spike_times) / bin_size).astype(np.int64)
+    first = bins.min() if len(bins) else 0
+    n_bins = (bins.max() - first + 1) if len(bins) else 1
+    counts = sparse.csr_matrix((np.ones(len(bins), dtype=np.int64), (trains.train_index(), bins - first)),
+                               shape=(len(trains), n_bins))
+    lag_blocks = np.array_split(np.arange(n_lags + 1), min(n_jobs, n_lags + 1) if parallel else 1)
+    if parallel:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(executor.map(_binned_block, repeat(counts), repeat(pairs), lag_blocks))
+    else:
+        results = [_binned_block(counts, pairs, lag_blocks[0])]
+    positive = np.concatenate([r[0] for r in results], axis=1)
+    negative = np.concatenate([r[1] for r in results], axis=1)
+    return np.concatenate((negative[:, :0:-1], positive), axis=1), lags, pairs
@@ -0,0 +1,172 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from .spiketrainset import SpikeTrainSet
+from .cache import cached
+
+METRICS = ('van_rossum', 'victor_purpura')
+
+
+def _decay_scan(decay, max_length):
+    """
+    Solves the recursion s_k = 1 + decay_k * s_{k-1} for all k at once by a parallel prefix scan (log2(max_length)
+    vectorized passes). decay_k = 0 starts a new sequence, so max_length is the longest run without such a reset.
+    """
+    s = np.ones(len(decay))
+    c = decay.copy()
+    shift = 1
+    while shift < max_length:
+        s[shift:] += c[shift:] * s[:-shift]
+        c[shift:] *= c[:-shift]
+        shift *= 2
+    return s
+
+
+def _exponential_sums(times, offsets, tau):
+    """
+    For every spike k, the sums of exp(-|t_k - t_j| / tau) over the spikes j <= k (forward) and j >= k (backward) of
+    the same spike train.
+    """
+    lengths = np.diff(offsets)
+    if len(times) == 0:
+        return np.zeros(0), np.zeros(0)
+    with np.errstate(over='ignore'):
+        # the decays across train boundaries are replaced by the resets below
+        decay = np.exp(-np.diff(times) / tau)
+    starts = offsets[:-1][lengths > 0]
+    forward = np.r_[0., decay]
+    forward[starts] = 0
+    backward = np.r_[decay, 0.]
+    backward[offsets[1:][lengths > 0] - 1] = 0
+    max_length = lengths.max()
+    return _decay_scan(forward, max_length), _decay_scan(backward[::-1], max_length)[::-1]
+
+
+def _van_rossum_rows(state, rows, block_size):
+    """
+    van Rossum distances of the pairs (i, j > i) for the rows i in range(*rows), in condensed order.
+    """
+    times, offsets, tau, forward, backward, keys, shift, norms = state
+    n_trains = len(offsets) - 1
+    distances = []
+    for i in range(*rows):
+        u = times[offsets[i]:offsets[i + 1]]
+        columns = np.arange(i + 1, n_trains)
+        cross = np.zeros(len(columns))
+        step = max(1, block_size // max(len(u), 1))
+        for first in range(0, len(columns) if len(u) else 0, step):
+            js = columns[first:first + step]
+            queries = np.tile(u, len(js))
+            train = np.repeat(js, len(u))
+            position = np.searchsorted(keys, queries + shift[train], 'right')
+            left, right = position - 1, np.minimum(position, len(times) - 1)
+            has_left = left >= offsets[train]
+            has_right = position < offsets[train + 1]
+            with np.errstate(over='ignore'):
+                values = np.where(has_left, forward[left] * np.exp(-(queries - times[left]) / tau), 0.)
+                values += np.where(has_right, backward[right] * np.exp(-(times[right] - queries) / tau), 0.)
+            cross[first:first + len(js)] = values.reshape(len(js), len(u)).sum(axis=1)
+        distances.append(np.sqrt(np.maximum(.5 * (norms[i] + norms[columns]) - cross, 0.)))
+    return np.concatenate(distances) if distances else np.zeros(0)
+
+
+def _victor_purpura_rows(state, rows, block_size):
+    """
+    Victor-Purpura distances of the pairs (i, j > i) for the rows i in range(*rows), in condensed order. The
+    dynamic program runs over the spikes of train i for all trains j of a block at once; within a row of the
+    program the insertions are resolved by a cumulative minimum.
+    """
+    times, offsets, cost = state
+    n_trains = len(offsets) - 1
+    lengths = np.diff(offsets)
+    distances = []
+    for i in range(*rows):
+        u = times[offsets[i]:offsets[i + 1]]
+        columns = np.arange(i + 1, n_trains)
+        result = np.zeros(len(columns))
+        step = max(1, block_size // max(lengths[i + 1:].max(initial=0) + 1, 1))
+        for first in range(0, len(columns), step):
+            js = columns[first:first + step]
+            m = lengths[js]
+            width = m.max(initial=0)
+            v = np.zeros((len(js), width))
+            flat = np.repeat(offsets[js] - (np.cumsum(m) - m), m) + np.arange(m.sum())
+            v[np.arange(width) < m[:, None]] = times[flat]
+            index = np.arange(width + 1)
+            g = np.tile(index.astype(float), (len(js), 1))
+            for r, spike in enumerate(u, 1):
+                t = np.empty_like(g)
+                t[:, 0] = r
+                np.minimum(g[:, 1:] + 1, g[:, :-1] + cost * np.abs(spike - v), out=t[:, 1:])
+                t -= index
+                g = np.minimum.accumulate(t, axis=1)
+                g += index
+            result[first:first + len(js)] = g[np.arange(len(js)), m]
+        distances.append(result)
+    return np.concatenate(distances) if distances else np.zeros(0)
+
+
+def _row_blocks(n_trains, n_blocks):
+    """
+    Splits the rows of the condensed matrix into n_blocks ranges with about the same number of pairs.
+    """
+    pairs = np.cumsum(np.arange(n_trains - 1, -1, -1))
+    bounds = np.searchsorted(pairs, np.linspace(0, pairs[-1] if n_trains else 0, n_blocks + 1)[1:-1])
+    bounds = np.unique(np.r_[0, bounds, n_trains])
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+@cached(version=1)
+def spike_distance_matrix(spike_trains, metric='van_rossum', tau=None, cost=None, n_jobs=None, block_size=2 ** 18):
+    """
+    Computes the distances between all pairs of spike trains as condensed matrix, i.e. the distances of the pairs
+    (0, 1), (0, 2), ..., (1, 2), ... in the order of scipy.spatial.distance.pdist (use scipy.spatial.distance.squareform
+    for the square matrix).
+
+    'van_rossum' is the distance of van Rossum (2001) for the exponential kernel,
+    D^2 = 1 / tau * integral (f(t) - g(t))^2 dt with f and g the spike trains convolved with exp(-t / tau).
+    It is computed in closed form from the spike times without binning: the sums of exp(-|t_k - t_j| / tau) over
+    the spikes before and after every spike are obtained once per train by recursion, after which every spike of one
+    train needs a single binary search in the other train.
+
+    'victor_purpura' is the edit distance of Victor and Purpura (1996): the minimal cost of transforming one train
+    into the other by deleting or inserting spikes (cost 1) and shifting spikes by dt (cost cost * |dt|). The
+    dynamic program is vectorized over the spikes of the second train and over blocks of pairs; its cost is
+    proportional to the product of the spike counts of every pair.
+
+    :param spike_trains: list of sorted 1D spike time arrays in seconds or a SpikeTrainSet
+    :param metric: 'van_rossum' or 'victor_purpura'
+    :param tau: the time constant of the van Rossum kernel in seconds
+    :param cost: the cost per second of shifting a spike for the Victor-Purpura distance
+    :param n_jobs: if given, the rows of the distance matrix are split into blocks with about the same number of pairs
+                   that are processed in a process pool
+    :param block_size: the number of values processed at once, bounds the temporary memory
+
+    :return: the condensed distance matrix as 1D numpy array of length n * (n - 1) / 2
+    """
+    trains = spike_trains if isinstance(spike_trains, SpikeTrainSet) else SpikeTrainSet.from_list(spike_trains)
+    times = np.asarray(trains.spike_times, dtype=float)
+    offsets = np.asarray(trains.offsets)
+    n_trains = len(trains)
+    if metric == 'van_rossum':
+        if tau is None:
+            raise ValueError("metric='van_rossum' requires tau")
+        forward, backward = _exponential_sums(times, offsets, tau)
+        norms = np.bincount(trains.train_index(), 2 * forward - 1, minlength=n_trains)
+        # spike times shifted per train such that all trains can be searched in one sorted array
+        span = times.max() - times.min() + 1. if len(times) else 1.
+        shift = np.arange(n_trains) * span - (times.min() if len(times) else 0.)
+        keys = times + shift[trains.train_index()]
+        state, function = (times, offsets, tau, forward, backward, keys, shift, norms), _van_rossum_rows
+    elif metric == 'victor_purpura':
+        if cost is None:
+            raise ValueError("metric='victor_purpura' requires cost")
+        state, function = (times, offsets, float(cost)), _victor_purpura_rows
+    else:
+        raise ValueError("metric must be one of %s" % ", ".join(METRICS))
+
+    if n_jobs is None or n_jobs < 2 or n_trains < 3:
+        return function(state, (0, n_trains), block_size)
+    blocks = _row_blocks(n_trains, 4 * n_jobs)
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        return np.concatenate(list(executor.map(function, repeat(state), blocks, repeat(block_size))))
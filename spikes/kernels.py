@@ -0,0 +1,222 @@
+import threading
+import numpy as np
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from ..instrumentation import instrument
+
+KERNEL_CACHE_SIZE = 128
+
+# bound of the total size of the cached kernel spectra in bytes. Spectra of more than a quarter of it (i.e. for very
+# long signals) are not cached but computed on every request.
+KERNEL_FFT_CACHE_BYTES = 2 ** 28
+
+KernelFFTCacheInfo = namedtuple('KernelFFTCacheInfo', ['hits', 'misses', 'max_bytes', 'bytes', 'entries'])
+
+
+def gauss_kernel(sigma, sample_rate, duration):
+    """
+    Creates a Gaussian kernel centered in a vector of given duration.
+
+    :param sigma: the standard deviation of the kernel in seconds
+    :param sample_rate: the temporal resolution of the kernel in Hz
+    :param duration: the desired duration of the kernel in seconds, (in general at least 4 * sigma)
+
+    :return: the kernel as numpy array
+    """
+    l = duration * sample_rate
+    x = np.arange(-np.floor(l / 2), np.floor(l / 2)) / sample_rate
+    y = (1 / (np.sqrt(2 * np.pi) * sigma)) * np.exp(-(x ** 2 / (2 * sigma ** 2)));
+    y /= np.sum(y)
+    return y
+
+
+def _time_axis(sample_rate, duration):
+    l = duration * sample_rate
+    return np.arange(-np.floor(l / 2), np.floor(l / 2)) / sample_rate
+
+
+def _exponential(x, tau):
+    return np.where(x >= 0, np.exp(-np.abs(x) / tau), 0.)
+
+
+def _alpha(x, tau):
+    return np.where(x >= 0, np.abs(x) / tau ** 2 * np.exp(-np.abs(x) / tau), 0.)
+
+
+def _half_gaussian(x, sigma):
+    return np.where(x >= 0, np.exp(-(x ** 2 / (2 * sigma ** 2))), 0.)
+
+
+def _boxcar(x, half_width):
+    return (np.abs(x) <= half_width).astype(float)
+
+
+def _triangular(x, half_width):
+    return np.clip(1 - np.abs(x) / half_width, 0., None)
+
+
+# name: (shape as function of time and width, default duration in multiples of the width)
+KERNELS = {
+    'gaussian': (None, 8),
+    'half_gaussian': (_half_gaussian, 8),
+    'exponential': (_exponential, 16),
+    'alpha': (_alpha, 20),
+    'boxcar': (_boxcar, 4),
+    'triangular': (_triangular, 4),
+}
+
+
+@instrument
+def make_kernel(name, width, sample_rate, duration=None):
+    """
+    Creates a kernel of the given shape centered in a vector of given duration. All kernels are sampled on the same
+    time axis as gauss_kernel and normalized to sum to one. Causal kernels ('half_gaussian', 'exponential', 'alpha')
+    are zero before the center of the vector.
+
+    :param name: one of 'gaussian', 'half_gaussian', 'exponential', 'alpha', 'boxcar' or 'triangular'
+    :param width: the width of the kernel in seconds. This is the standard deviation for the Gaussians, the time
+                  constant for 'exponential' and 'alpha' and the half-width for 'boxcar' and 'triangular'.
+    :param sample_rate: the temporal resolution of the kernel in Hz
+    :param duration: the duration of the kernel in seconds. If None, a default multiple of width is used that covers
+                     the kernel (e.g. 8 * width for 'gaussian').
+
+    :return: the kernel as numpy array
+    """
+    if name not in KERNELS:
+        raise ValueError("Unknown kernel %s. Available kernels are: %s" % (name, ", ".join(sorted(KERNELS))))
+    shape, factor = KERNELS[name]
+    if duration is None:
+        duration = width * factor
+    if shape is None:
+        return gauss_kernel(width, sample_rate, duration)
+    y = shape(_time_axis(sample_rate, duration), width)
+    y /= np.sum(y)
+    return y
+
+
+@lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def _cached_kernel(name, width, sample_rate, duration):
+    y = make_kernel(name, width, sample_rate, duration)
+    y.flags.writeable = False
+    return y
+
+
+def _next_fast_len(n):
+    """
+    Returns the smallest 5-smooth number (only prime factors 2, 3 and 5) that is not smaller than n. FFTs of
+    these lengths are considerably faster than those of arbitrary lengths.
+    """
+    if n <= 16:
+        return max(int(n), 1)
+    best = 2 ** int(np.ceil(np.log2(n)))
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            quotient = -(-n // p35)
+            p2 = 2 ** int(np.ceil(np.log2(quotient)))
+            candidate = p2 * p35
+            if candidate == n:
+                return n
+            best = min(best, candidate)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+class _SpectrumCache(object):
+    """
+    LRU cache of kernel spectra bounded by their total size in bytes instead of their number, since a spectrum is
+    as long as the signal it is padded for.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, name, width, sample_rate, n_samples, duration, dtype):
+        key = (name, width, sample_rate, n_samples, duration, dtype)
+        with self._lock:
+            spectrum = self._entries.get(key)
+            if spectrum is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return spectrum
+            self.misses += 1
+        kernel = _cached_kernel(name, width, sample_rate, duration)
+        spectrum = np.fft.rfft(kernel, _next_fast_len(n_samples + len(kernel) - 1)).astype(dtype, copy=False)
+        spectrum.flags.writeable = False
+        if spectrum.nbytes > KERNEL_FFT_CACHE_BYTES // 4:
+            return spectrum
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = spectrum
+                self.bytes += spectrum.nbytes
+            while self.bytes > KERNEL_FFT_CACHE_BYTES:
+                self.bytes -= self._entries.popitem(last=False)[1].nbytes
+        return spectrum
+
+    def cache_clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = self.hits = self.misses = 0
+
+    def cache_info(self):
+        with self._lock:
+            return KernelFFTCacheInfo(self.hits, self.misses, KERNEL_FFT_CACHE_BYTES, self.bytes, len(self._entries))
+
+
+_cached_kernel_fft = _SpectrumCache()
+
+
+def get_kernel(name, width, sample_rate, duration=None):
+    """
+    Returns the kernel created by make_kernel from a bounded LRU cache. Repeated requests for the same parameters
+    return the same read-only array.
+
+    :param name: the kernel shape, see make_kernel
+    :param width: the width of the kernel in seconds
+    :param sample_rate: the temporal resolution of the kernel in Hz
+    :param duration: the duration of the kernel in seconds or None for the default
+
+    :return: the kernel as read-only numpy array
+    """
+    return _cached_kernel(name, float(width), float(sample_rate), None if duration is None else float(duration))
+
+
+def get_kernel_fft(name, width, sample_rate, n_samples, duration=None, dtype=np.complex128):
+    """
+    Returns the real FFT of a cached kernel, zero padded for the linear convolution with a signal of n_samples
+    samples. The FFT length is the next 5-smooth number not smaller than n_samples + len(kernel) - 1. The cache of
+    the spectra is bounded by KERNEL_FFT_CACHE_BYTES; spectra larger than a quarter of it are not cached.
+
+    :param name: the kernel shape, see make_kernel
+    :param width: the width of the kernel in seconds
+    :param sample_rate: the temporal resolution of the kernel in Hz
+    :param n_samples: the length of the signal the kernel is convolved with
+    :param duration: the duration of the kernel in seconds or None for the default
+    :param dtype: complex type of the spectrum, numpy.complex64 for convolutions in single precision
+
+    :return: the spectrum as read-only complex numpy array
+    """
+    return _cached_kernel_fft(name, float(width), float(sample_rate), int(n_samples),
+                              None if duration is None else float(duration), np.dtype(dtype).str)
+
+
+def clear_kernel_cache():
+    """
+    Empties the kernel and kernel FFT caches.
+    """
+    _cached_kernel.cache_clear()
+    _cached_kernel_fft.cache_clear()
+
+
+def kernel_cache_info():
+    """
+    :return: the cache statistics (hits, misses, maxsize, currsize) of the kernel cache and (hits, misses,
+             max_bytes, bytes, entries) of the kernel FFT cache
+    """
+    return _cached_kernel.cache_info(), _cached_kernel_fft.cache_info()
@@ -0,0 +1,81 @@
+import datetime as dt
+import warnings
+from collections import namedtuple
+from functools import lru_cache
+from ..instrumentation import instrument
+
+Provenance = namedtuple('Provenance', ['analysis', 'parameters', 'date'])
+Provenance.__doc__ = """
+Lightweight record of the analysis that produced a result, as returned by the spikes functions with
+return_metadata=True. parameters is a tuple of (name, value, unit) triples. Records with identical content are the
+same object, so keeping one per result costs nothing. Use to_odml to convert them to odml sections.
+"""
+
+# analysis: (section name, section type, description)
+ANALYSES = {
+    'psth': ("PSTH", "analysis/psth", "PSTH estimated by convolution with a kernel."),
+    'serial_correlation': ("Serial correlation", "analysis/serial_correlation",
+                           "The serial correlation of inter-spike-intervals."),
+}
+
+
+@lru_cache(maxsize=1024)
+def _record(analysis, parameters, date):
+    return Provenance(analysis, parameters, date)
+
+
+@instrument
+def make_provenance(analysis, *parameters):
+    """
+    Returns the provenance record of an analysis run today with the given parameters. Repeated calls with the same
+    arguments return the same record.
+
+    :param analysis: the name of the analysis, one of the keys of ANALYSES
+    :param parameters: (name, value, unit) triples, unit may be None
+    :return: the Provenance record
+    """
+    return _record(analysis, tuple(parameters), dt.date.today().isoformat())
+
+
+def _load_odml():
+    """
+    Imports odml on first use, i.e. only when metadata are exported.
+
+    :return: the odml module or None if it is not installed
+    """
+    try:
+        import odml
+    except ImportError:
+        warnings.warn("odml package not available. Install via pip (sudo pip install odml) or get it on Github (https://github.com/G-Node/python-odml)")
+        return None
+    return odml
+
+
+@instrument
+def to_odml(records):
+    """
+    Converts provenance records to odml sections. Duplicate records are converted only once.
+
+    :param records: a Provenance record or an iterable of records
+    :return: list of odml.Section, one per distinct record, in order of first occurrence
+    """
+    odml = _load_odml()
+    if odml is None:
+        raise ImportError("to_odml requires the odml package.")
+    if isinstance(records, Provenance):
+        records = [records]
+    sections = []
+    for record in dict.fromkeys(records):
+        name, section_type, description = ANALYSES[record.analysis]
+        section = odml.Section(name, section_type)
+        section.append(odml.Property("Description", description))
+        for key, value, unit in record.parameters:
+            if unit is None:
+                section.append(odml.Property(key, value))
+            elif hasattr(odml, 'Value'):
+                section.append(odml.Property(key, odml.Value(value, unit=unit)))
+            else:
+                section.append(odml.Property(key, value, unit=unit))
+        section.append(odml.Property("Date", record.date))
+        sections.append(section)
+    return sections
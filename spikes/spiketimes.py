@@ -1,101 +1,681 @@
 import numpy as np
-import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import namedtuple
+from itertools import repeat
+from .kernels import gauss_kernel, get_kernel, get_kernel_fft, _next_fast_len
+from .spiketrainset import SpikeTrainSet
+from .provenance import make_provenance
+from .cache import cached
+from ..instrumentation import instrument
 
-try:
-    __import__('odml')
-except ImportError:
-    warnings.warn("odml package not available. Install via pip (sudo pip install odml) or get it on Github (https://github.com/G-Node/python-odml)")
 
 
-def gauss_kernel(sigma, sample_rate, duration):
+PackedBinary = namedtuple('PackedBinary', ['bits', 'n_samples'])
+PackedBinary.__doc__ = """
+Bit-packed binary representation of a spike train as returned by spike_times_to_binary(..., output='packed').
+bits holds the result of numpy.packbits along the last axis, n_samples the number of samples before packing.
+"""
+
+BINARY_FORMATS = ('float', 'bool', 'uint8', 'packed', 'count', 'sparse')
+
+# number of values transformed at once by the FFT convolution, bounds its temporary memory
+FFT_BLOCK_SIZE = 2 ** 20
+
+
+def _fft_module(dtype):
     """
-    Creates a Gaussian kernel centered in a vector of given duration.
+    numpy.fft needs several times the memory of the result for single precision transforms. For these scipy.fft is
+    used if it is installed.
+    """
+    if np.dtype(dtype) == np.float32:
+        try:
+            from scipy import fft
+            return fft
+        except ImportError:
+            pass
+    return np.fft
 
-    :param sigma: the standard deviation of the kernel in seconds
-    :param sample_rate: the temporal resolution of the kernel in Hz
-    :param duration: the desired duration of the kernel in seconds, (in general at least 4 * sigma)
 
-    :return: the kernel as numpy array
+def _fft_convolve_same(data, kernel, kernel_fft=None, out=None, scale=1., dtype=None, block_size=None):
     """
-    l = duration * sample_rate
-    x = np.arange(-np.floor(l / 2), np.floor(l / 2)) / sample_rate
-    y = (1 / (np.sqrt(2 * np.pi) * sigma)) * np.exp(-(x ** 2 / (2 * sigma ** 2)));
-    y /= np.sum(y)
-    return y
+    Convolves every row of data (along the last axis) with the kernel and multiplies the result by scale. The result
+    is cut to the length of the rows in the same way as numpy.convolve(row, kernel, mode='same'). A precomputed kernel
+    spectrum (see kernels.get_kernel_fft) can be passed to avoid transforming the kernel again.
+
+    The rows are transformed in blocks along the first axis of about FFT_BLOCK_SIZE values, converted to dtype block
+    by block, and the result is written into out (allocated if None). Temporary memory is therefore bounded by the
+    block size (or a single row) and not by the size of data. If block_size is given, the rows are instead convolved
+    in blocks along the time axis, see _overlap_save.
 
+    The result equals numpy.convolve up to FFT rounding errors of about 1e-14 (float32: 1e-6) times the largest
+    value of the row. For a non-negative kernel and scale, the negative rounding residues of blocks whose data are
+    non-negative (e.g. spike counts) are set to 0 where numpy.convolve gives exact zeros. Signed data are not
+    clipped.
+    """
+    n = data.shape[-1]
+    m = len(kernel)
+    dtype = np.dtype(dtype if dtype is not None else (out.dtype if out is not None else float))
+    # whether the output of non-negative data is non-negative
+    clip = scale >= 0 and np.min(kernel, initial=0) >= 0
+    unsigned = data.dtype.kind in 'bu'
+    if block_size is not None:
+        result = np.empty(data.shape, dtype=dtype) if out is None else out
+        return _overlap_save(data, kernel, kernel_fft, result, scale, dtype, block_size, clip, unsigned)
+    nfft = _next_fast_len(n + m - 1)
+    if kernel_fft is None:
+        kernel_fft = np.fft.rfft(kernel, nfft)
+    kernel_fft = kernel_fft.astype(np.result_type(dtype, np.complex64), copy=False)
+    result = np.empty(data.shape, dtype=dtype) if out is None else out
+    start = (m - 1) // 2
+    rows, out_rows = (data[None], result[None]) if data.ndim == 1 else (data, result)
+    fft = _fft_module(dtype)
+    step = max(1, FFT_BLOCK_SIZE // (nfft * int(np.prod(rows.shape[1:-1]))))
+    for i in range(0, len(rows), step):
+        block = np.asarray(rows[i:i + step], dtype=dtype)
+        spectrum = fft.rfft(block, nfft, axis=-1)
+        spectrum *= kernel_fft
+        np.multiply(fft.irfft(spectrum, nfft, axis=-1)[..., start:start + n], scale, out=out_rows[i:i + step])
+        del spectrum
+        if clip and (unsigned or block.min(initial=0) >= 0):
+            np.maximum(out_rows[i:i + step], 0, out=out_rows[i:i + step])
+    return result
 
-def binary_spike_train_to_rate(binary, sample_rate, kernel_width, return_metadata=True):
+
+def _overlap_save(data, kernel, kernel_fft, out, scale, dtype, block_size, clip=False, unsigned=False):
+    """
+    Overlap-save version of _fft_convolve_same. Every block of block_size output samples is computed from the
+    block_size + len(kernel) - 1 input samples it depends on (zero beyond the ends of data) with one FFT of length
+    _next_fast_len(block_size + len(kernel) - 1), so kernel_fft has to be padded for n_samples=block_size. Only one
+    block of data is read at a time, which allows data and out to be memory mapped files. The values of a block do
+    not depend on the length of data or on how it is stored, only on block_size. If clip is true, negative values
+    of blocks whose input is non-negative (always if unsigned is true) are set to 0.
+    """
+    n = data.shape[-1]
+    m = len(kernel)
+    nfft = _next_fast_len(block_size + m - 1)
+    if kernel_fft is None:
+        kernel_fft = np.fft.rfft(kernel, nfft)
+    kernel_fft = kernel_fft.astype(np.result_type(dtype, np.complex64), copy=False)
+    fft = _fft_module(dtype)
+    start = (m - 1) // 2
+    segment = np.empty(data.shape[:-1] + (block_size + m - 1,), dtype=dtype)
+    for first in range(0, n, block_size):
+        length = min(block_size, n - first)
+        lo = first + start - (m - 1)
+        begin, end = max(lo, 0), min(first + start + length, n)
+        segment[..., :begin - lo] = 0
+        segment[..., begin - lo:end - lo] = data[..., begin:end]
+        segment[..., end - lo:] = 0
+        spectrum = fft.rfft(segment, nfft, axis=-1)
+        spectrum *= kernel_fft
+        np.multiply(fft.irfft(spectrum, nfft, axis=-1)[..., m - 1:m - 1 + length], scale,
+                    out=out[..., first:first + length])
+        del spectrum
+        if clip and (unsigned or segment.min(initial=0) >= 0):
+            np.maximum(out[..., first:first + length], 0, out=out[..., first:first + length])
+    return out
+
+
+def _output(out, shape, dtype, zero=True):
+    """
+    Returns a new array of the given shape and dtype, or out after checking that it can hold the result. The array
+    is set to zero unless zero is False.
+    """
+    if out is None:
+        return np.zeros(shape, dtype=dtype) if zero else np.empty(shape, dtype=dtype)
+    if out.shape != tuple(shape):
+        raise ValueError("out must have shape %s, got %s" % (tuple(shape), out.shape))
+    if not out.flags.c_contiguous:
+        raise ValueError("out must be C-contiguous")
+    if zero:
+        out[...] = 0
+    return out
+
+
+def _resolve_kernel(kernel, kernel_width, sample_rate):
+    """
+    Returns the kernel array and its name (None for user supplied arrays).
+    """
+    if isinstance(kernel, str):
+        return get_kernel(kernel, kernel_width, sample_rate), kernel
+    return np.asarray(kernel, dtype=float), None
+
+
+@instrument
+@cached(version=1)
+def binary_spike_train_to_rate(binary, sample_rate, kernel_width, return_metadata=False, axis=-1, n_jobs=None,
+                               kernel='gaussian', dtype=None, out=None, block_size=None):
     """
     Converts the binary representation of a spike train to a spike rate. Conversion is done by convolving the binary
-    data with a Gaussian kernel of the specified width.
+    data with a kernel of the specified width, by default a Gaussian.
+
+    Multiple trials (or units x trials) can be passed at once as a 2-D or 3-D array. All rows are then convolved in a
+    single FFT pass along the given axis, which is much faster than calling the function once per trial.
+
+    The rate equals the direct convolution (numpy.convolve(row, kernel, mode='same') * sample_rate) up to FFT
+    rounding errors of about 1e-14 (float32: 1e-6) times the peak rate. For non-negative kernels and non-negative
+    binary data, the rounding residues below zero are set to 0, so the rate is never negative.
+
+    Peak memory: besides binary and the result, the FFT needs about 5 * max(FFT_BLOCK_SIZE, n_fft) * itemsize bytes,
+    where n_fft is the padded length of a row (samples plus kernel length) and itemsize that of dtype. With
+    block_size, n_fft is the padded block length and FFT_BLOCK_SIZE does not apply, the bound holds per row. Packed
+    and sparse inputs need about 2 ** 20 * (24 + itemsize) bytes in addition to the result.
+
+    :param binary: Binary representation of a spike train. 1 represents the occurrence of a spike, 0 its absence.
+                   May have any number of dimensions, the time axis is given by axis. Any of the representations
+                   returned by spike_times_to_binary is accepted; packed and sparse inputs are not densified but
+                   evaluated around each spike as in spike_times_to_rate (axis is ignored for these).
+    :param sample_rate: the rate in Hz in which the data has been sampled
+    :param kernel_width: the width of the kernel in seconds (the standard deviation of the Gaussian kernel)
+    :param return_metadata: If true a Provenance record of the analysis is returned as well (see provenance.to_odml)
+    :param axis: the time axis of binary (default: last axis)
+    :param n_jobs: if given, the rows are split into n_jobs blocks that are convolved in a process pool. Useful for
+                   inputs that are too large to be handled efficiently on one core.
+    :param kernel: the name of a kernel shape (see kernels.make_kernel) or a kernel as numpy array sampled at
+                   sample_rate and centered like gauss_kernel. Named kernels and their FFTs are cached.
+    :param dtype: floating point type of the computation and the result, e.g. numpy.float32 to halve the memory
+                  (default: the dtype of out, or float64)
+    :param out: C-contiguous array of the shape of binary the result is written into
+    :param block_size: if given, the rows are convolved in blocks of block_size samples along the time axis
+                       (overlap-save), which bounds the FFT length for very long recordings. The result is the same
+                       as without blocks up to floating point rounding, see also binary_file_to_rate.
 
-    :param binary: Binary representation of a spike train. 1 represents the occurrence of a spike, 0 its absence
+    :return: the rate as numpy array of the same shape as binary (out if given)
+    """
+    dtype = np.dtype(dtype if dtype is not None else (out.dtype if out is not None else float))
+    g, name = _resolve_kernel(kernel, kernel_width, sample_rate)
+    if _is_sparse(binary) or isinstance(binary, PackedBinary):
+        shape, n_samples, rows, bins, counts = _spike_bins(binary)
+        rate = _output(out, shape + (n_samples,), dtype, zero=False)
+        _rate_from_bins(bins, n_samples, g, sample_rate, weights=counts, rows=rows, n_rows=int(np.prod(shape)),
+                        out=rate.reshape(-1, n_samples))
+        return _with_metadata(rate, kernel_width, name, return_metadata)
+    binary = np.asarray(binary)
+    rate = _output(out, binary.shape, dtype, zero=False)
+    data, result = np.moveaxis(binary, axis, -1), np.moveaxis(rate, axis, -1)
+    g_fft = None if name is None else get_kernel_fft(name, kernel_width, sample_rate, block_size or data.shape[-1],
+                                                     dtype=np.result_type(dtype, np.complex64))
+    if n_jobs is None or n_jobs < 2 or data.ndim < 2:
+        _fft_convolve_same(data, g, g_fft, out=result, scale=sample_rate, dtype=dtype, block_size=block_size)
+    else:
+        rows = data.reshape(-1, data.shape[-1])
+        blocks = np.array_split(rows, min(n_jobs, len(rows)))
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            converted = executor.map(_fft_convolve_same, blocks, repeat(g), repeat(g_fft), repeat(None),
+                                     repeat(sample_rate), repeat(dtype), repeat(block_size))
+            result[...] = np.concatenate(list(converted)).reshape(data.shape)
+    return _with_metadata(rate, kernel_width, name, return_metadata)
+
+
+@instrument
+def binary_file_to_rate(path, sample_rate, kernel_width, out_path, kernel='gaussian', block_size=2 ** 20,
+                        dtype=None, raw_dtype=np.uint8, return_metadata=False):
+    """
+    Out-of-core version of binary_spike_train_to_rate for recordings that do not fit into memory. The binary
+    representation is read from a memory mapped file and the rate is written to a memory mapped .npy file, both in
+    blocks of block_size samples (overlap-save convolution with the cached kernel FFT). Only a few blocks are held
+    in memory at a time.
+
+    The result is bit-identical to binary_spike_train_to_rate(numpy.load(path), ..., block_size=block_size) and
+    agrees with the unblocked result up to floating point rounding, also at the block boundaries.
+
+    :param path: a .npy file with the binary representation (time on the last axis) or a raw file of raw_dtype
+                 values of a single spike train
     :param sample_rate: the rate in Hz in which the data has been sampled
-    :param kernel_width: the standard deviation of the Gaussian kernel in seconds
-    :param return_metadata: If true the analysis metadata are returned as odml section
+    :param kernel_width: the width of the kernel in seconds (the standard deviation of the Gaussian kernel)
+    :param out_path: the .npy file the rate is written to, it is created or overwritten
+    :param kernel: the name of a kernel shape or a kernel array, see binary_spike_train_to_rate
+    :param block_size: the number of samples convolved at once
+    :param dtype: floating point type of the computation and the result, e.g. numpy.float32 (default: float64)
+    :param raw_dtype: the type of the samples in raw files, e.g. numpy.uint8 as written by
+                      spike_times_to_binary(..., output='uint8').tofile(path)
+    :param return_metadata: If true a Provenance record of the analysis is returned as well (see provenance.to_odml)
 
-    :return: the rate vector as numpy array
+    :return: the rate as read-only memory map of out_path
     """
-    g = gauss_kernel(kernel_width, sample_rate, kernel_width * 8)
-    rate = convolve(binary, g, mode='same') * sample_rate
+    if str(path).endswith('.npy'):
+        binary = np.load(path, mmap_mode='r')
+    else:
+        binary = np.memmap(path, dtype=raw_dtype, mode='r')
+    dtype = np.dtype(dtype if dtype is not None else float)
+    rate = np.lib.format.open_memmap(out_path, mode='w+', dtype=dtype, shape=binary.shape)
+    try:
+        binary_spike_train_to_rate(binary, sample_rate, kernel_width, kernel=kernel, dtype=dtype, out=rate,
+                                   block_size=block_size)
+        rate.flush()
+    finally:
+        del rate, binary
+    rate = np.load(out_path, mmap_mode='r')
+    name = kernel if isinstance(kernel, str) else None
+    return _with_metadata(rate, kernel_width, name, return_metadata)
+
 
-    if not return_metadata or 'odml' not in globals():
+def _with_metadata(rate, kernel_width, kernel_name, return_metadata):
+    if not return_metadata:
         return rate
-    metadata = odml.Section("PSTH", "analysis/psth")
-    metadata.append(odml.Property("Description", "PSTH estimated by convolution with a Gaussian kernel."))
-    value = odml.Value(kernel_width, unit='s')
-    metadata.append(odml.Property("KernelWidth", value))
-    metadata.append(odml.Property("KernelType", "Gaussian"))
-    metadata.append(odml.Property("Date", dt.date.today().isoformat()))
-    return rate, metadata
+    return rate, make_provenance('psth', ("KernelWidth", kernel_width, 's'),
+                                 ("KernelType", kernel_name or "custom", None))
 
 
-def spike_times_to_binary(spike_times, sample_rate, duration):
+@instrument
+def spike_times_to_binary(spike_times, sample_rate, duration, output='float', dtype=None, out=None):
     """
     Converts a spike train from the spike time representation to a binary representation
     i.e. a vector of zeros in which spike occurence is marked with a 1
 
+    Several output formats are available. 'float' is the classic dense float64 vector. 'bool' and 'uint8' are dense
+    vectors that need an eighth of the memory, 'packed' stores one bit per sample (see PackedBinary). 'count' holds
+    the number of spikes per bin instead of collapsing several spikes in the same bin to a single 1. 'sparse' returns
+    a scipy.sparse CSR matrix of spike counts with one row per spike train.
+
+    Several spike trains can be converted at once by passing a SpikeTrainSet or a list of spike time arrays; the
+    result then has one row per train. Except for a single train in 'float' format, spikes outside [0, duration)
+    are ignored.
+
+    Peak memory: the dense result plus about 24 bytes per spike for the sample indices.
+
     :param spike_times: The times at which a spike occurred, times should be given in seconds.
     :param sample_rate: The rate, in Hz, in which the binary representation should be given.
     :param duration: The duration of the binary vector in seconds
+    :param output: one of 'float', 'bool', 'uint8', 'packed', 'count' or 'sparse' (default: 'float')
+    :param dtype: dtype of the 'float' (default float64) and 'count' (default int64) outputs
+    :param out: C-contiguous array the dense 'float', 'bool', 'uint8' or 'count' result is written into
 
-    :return: binary representation of the data :numpy.ndarray
+    :return: binary representation of the data :numpy.ndarray (out if given), PackedBinary or
+             scipy.sparse.csr_matrix
 
     """
+    if output not in BINARY_FORMATS:
+        raise ValueError("output must be one of %s" % ", ".join(BINARY_FORMATS))
+    if out is not None and output in ('packed', 'sparse'):
+        raise ValueError("out is not supported for output='%s'" % output)
+    n_samples = int(duration * sample_rate)
+    spike_times = _single_train(spike_times)
+    if isinstance(spike_times, (SpikeTrainSet, list, tuple)) or output == 'sparse':
+        trains = _as_train_set(spike_times)
+        rows, bins = _train_set_bins(trains, sample_rate, n_samples)
+        return _bins_to_binary(rows, bins, len(trains), n_samples, output, dtype, out)
     if len(spike_times.shape) > 1:
         raise ValueError("spike_times must not have more than one dimension")
-    binary = np.zeros(int(duration * sample_rate))
-    indices = np.asarray(spike_times  * sample_rate, dtype=int)
-    binary[indices] = 1
+    if output == 'float':
+        binary = _output(out, (n_samples,), dtype or float)
+        indices = np.asarray(spike_times  * sample_rate, dtype=int)
+        binary[indices] = 1
+        return binary
+
+    indices = np.asarray(spike_times * sample_rate, dtype=int)
+    indices = indices[(indices >= 0) & (indices < n_samples)]
+    return _bins_to_binary(None, indices, None, n_samples, output, dtype, out)
+
+
+def _single_train(spike_times):
+    """
+    Returns a list or tuple of scalar spike times as 1D array (a single train), anything else unchanged.
+    """
+    if isinstance(spike_times, (list, tuple)) and len(spike_times) and all(np.ndim(t) == 0 for t in spike_times):
+        return np.asarray(spike_times, dtype=float)
+    return spike_times
+
+
+def _as_train_set(spike_times):
+    if isinstance(spike_times, SpikeTrainSet):
+        return spike_times
+    spike_times = _single_train(spike_times)
+    if isinstance(spike_times, np.ndarray) and spike_times.ndim == 1 and spike_times.dtype != object:
+        spike_times = [spike_times]
+    return SpikeTrainSet.from_list(spike_times)
+
+
+def _train_set_bins(trains, sample_rate, n_samples):
+    """
+    :return: train index and sample index of all spikes of the SpikeTrainSet that fall into [0, n_samples)
+    """
+    bins = np.asarray(np.asarray(trains.spike_times) * sample_rate, dtype=int)
+    valid = (bins >= 0) & (bins < n_samples)
+    return trains.train_index()[valid], bins[valid]
+
+
+def _bins_to_binary(rows, bins, n_rows, n_samples, output, dtype=None, out=None):
+    """
+    Creates the requested binned representation from the sample indices of the spikes. If rows is None, the result
+    is 1D, otherwise it has n_rows rows. Dense results are written into out if given.
+    """
+    shape = (n_samples,) if rows is None else (n_rows, n_samples)
+    flat = bins if rows is None else rows * n_samples + bins
+    if output == 'sparse':
+        try:
+            from scipy import sparse
+        except ImportError:
+            raise ImportError("output='sparse' requires scipy. Install via pip (pip install scipy).")
+        if rows is None:
+            rows, shape = np.zeros(len(bins), dtype=int), (1, n_samples)
+        counts = sparse.coo_matrix((np.ones(len(bins), dtype=np.int64), (rows, bins)), shape=shape)
+        return counts.tocsr()
+    if output == 'count':
+        if out is None and np.dtype(dtype or np.int64) == np.int64:
+            return np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape)
+        # counted directly in the requested dtype, without an int64 intermediate of the size of the result
+        counts = _output(out, shape, dtype or np.int64)
+        np.add.at(counts.reshape(-1), flat, 1)
+        return counts
+    if output == 'packed':
+        # the bits are set directly in the bytes in the order of numpy.packbits
+        n_bytes = (n_samples + 7) // 8
+        bits = np.zeros(shape[:-1] + (n_bytes,), dtype=np.uint8)
+        index = bins >> 3 if rows is None else rows * n_bytes + (bins >> 3)
+        np.bitwise_or.at(bits.reshape(-1), index, (128 >> (bins & 7)).astype(np.uint8))
+        return PackedBinary(bits, n_samples)
+    binary = _output(out, shape, {'float': dtype or float, 'uint8': np.uint8}.get(output, bool))
+    binary.reshape(-1)[flat] = 1
     return binary
 
 
-def serial_correlation(spike_times, max_lags=50, return_metadata=True):
+def _is_sparse(binary):
+    return hasattr(binary, 'tocsr') and hasattr(binary, 'nnz')
+
+
+def _spike_bins(binary):
+    """
+    Extracts the spikes from a sparse, packed or dense binned representation without creating a dense copy.
+
+    :return: the shape of the leading (row) dimensions, the number of samples, and for every non-empty bin its
+             flat row index, its bin index and the number of spikes in it
+    """
+    if _is_sparse(binary):
+        csr = binary.tocsr()
+        csr.sum_duplicates()
+        rows = np.repeat(np.arange(csr.shape[0]), np.diff(csr.indptr))
+        return (csr.shape[0],), csr.shape[1], rows, csr.indices.astype(np.int64), csr.data
+    if isinstance(binary, PackedBinary):
+        bits = np.asarray(binary.bits)
+        shape = bits.shape[:-1]
+        bits = bits.reshape(-1, bits.shape[-1])
+        rows, byte = np.nonzero(bits)
+        unpacked = np.unpackbits(bits[rows, byte][:, None], axis=1).astype(bool)
+        hit_rows, hit_bits = np.nonzero(unpacked)
+        bins = byte[hit_rows].astype(np.int64) * 8 + hit_bits
+        valid = bins < binary.n_samples
+        return shape, binary.n_samples, rows[hit_rows][valid], bins[valid], np.ones(valid.sum())
+    binary = np.asarray(binary)
+    shape = binary.shape[:-1]
+    flat = binary.reshape(-1, binary.shape[-1])
+    rows, bins = np.nonzero(flat)
+    return shape, binary.shape[-1], rows, bins, flat[rows, bins]
+
+
+def _rate_from_bins(bins, n_samples, kernel, sample_rate, weights=None, rows=None, n_rows=None,
+                    block_size=2 ** 20, out=None, dtype=None):
+    """
+    Event driven evaluation of the kernel sum. Every spike bin adds the kernel (times its weight, e.g. the spike
+    count) to the rate around itself, positioned as in a mode='same' convolution. If rows are given, the result has
+    one row per spike train. Spikes are processed in blocks so that at most block_size kernel values are held in
+    memory at a time. The result is accumulated in out if given.
+    """
+    rate = _output(out, (n_samples,) if rows is None else (n_rows, n_samples), dtype or float)
+    if len(bins) == 0:
+        return rate
+    flat = rate.reshape(-1)
+    scaled = (kernel * sample_rate).astype(rate.dtype, copy=False)
+    offsets = np.arange(len(kernel)) - (len(kernel) - 1) // 2
+    step = max(1, block_size // len(kernel))
+    for i in range(0, len(bins), step):
+        indices = bins[i:i + step, None] + offsets
+        values = np.broadcast_to(scaled, indices.shape)
+        if weights is not None:
+            values = values * np.asarray(weights[i:i + step], dtype=rate.dtype)[:, None]
+        valid = (indices >= 0) & (indices < n_samples)
+        if rows is not None:
+            indices = indices + rows[i:i + step, None] * n_samples
+        np.add.at(flat, indices[valid], values[valid])
+    return rate
+
+
+@instrument
+@cached(version=1)
+def spike_times_to_rate(spike_times, sample_rate, duration, kernel_width, kernel='gaussian', dtype=None, out=None):
+    """
+    Converts spike times directly to a spike rate without creating the binary representation. The kernel is
+    only evaluated around each spike, so computation time and temporary memory scale with the number of spikes and not
+    with the duration of the recording.
+
+    The result is the same as that of
+    binary_spike_train_to_rate(spike_times_to_binary(spike_times, sample_rate, duration), sample_rate, kernel_width).
+    Spikes outside [0, duration) are ignored. For a SpikeTrainSet or a list of spike trains the result has one row
+    per train.
+
+    Peak memory: the result plus about 2 ** 20 * (24 + itemsize) bytes for blocks of kernel values and about 40 bytes
+    per spike for the sample indices.
+
+    :param spike_times: The times at which a spike occurred, times should be given in seconds.
+    :param sample_rate: The rate, in Hz, in which the rate should be given.
+    :param duration: The duration of the rate vector in seconds
+    :param kernel_width: the width of the kernel in seconds (the standard deviation of the Gaussian kernel)
+    :param kernel: the name of a kernel shape or a kernel array, see binary_spike_train_to_rate
+    :param dtype: floating point type of the result, e.g. numpy.float32 (default: the dtype of out, or float64)
+    :param out: C-contiguous array the result is written into
+
+    :return: the rate vector as numpy array (out if given)
+    """
+    n_samples = int(duration * sample_rate)
+    dtype = dtype if dtype is not None else (out.dtype if out is not None else float)
+    g, _ = _resolve_kernel(kernel, kernel_width, sample_rate)
+    spike_times = _single_train(spike_times)
+    if isinstance(spike_times, (SpikeTrainSet, list, tuple)):
+        trains = _as_train_set(spike_times)
+        rows, bins = _train_set_bins(trains, sample_rate, n_samples)
+        flat = np.unique(rows * n_samples + bins)
+        return _rate_from_bins(flat % n_samples, n_samples, g, sample_rate, rows=flat // n_samples,
+                               n_rows=len(trains), out=out, dtype=dtype)
+    spike_times = np.asarray(spike_times)
+    if len(spike_times.shape) > 1:
+        raise ValueError("spike_times must not have more than one dimension")
+    bins = np.unique(np.asarray(spike_times * sample_rate, dtype=int))
+    bins = bins[(bins >= 0) & (bins < n_samples)]
+    return _rate_from_bins(bins, n_samples, g, sample_rate, out=out, dtype=dtype)
+
+
+def _bootstrap_means(rates, seeds, n_draws):
+    """
+    Means of bootstrap resamples of the rows of rates. Every block of draws uses its own seed. The resampled trials
+    are turned into a (draws x trials) weight matrix, so the means of a block are a single matrix product.
+    """
+    n_trials = len(rates)
+    means = []
+    for seed, n in zip(seeds, n_draws):
+        index = np.random.default_rng(seed).integers(0, n_trials, size=(n, n_trials))
+        weights = np.bincount((index + n_trials * np.arange(n)[:, None]).ravel(), minlength=n * n_trials)
+        block = weights.reshape(n, n_trials).astype(rates.dtype) @ rates
+        block /= n_trials
+        means.append(block)
+    return np.concatenate(means) if means else np.zeros((0, rates.shape[1]), dtype=rates.dtype)
+
+
+@instrument
+@cached(version=1, condition=lambda arguments: arguments['n_boot'] == 0 or arguments['seed'] is not None)
+def psth(spike_trains, sample_rate, duration, kernel_width, kernel='gaussian', n_boot=0, ci=95., seed=None,
+         n_jobs=None, backend='thread', block_size=256, return_metadata=False, dtype=None):
+    """
+    Computes the trial-averaged rate (peri-stimulus time histogram) of a set of trials together with its standard
+    error and, optionally, bootstrap percentile confidence bands.
+
+    The rates of all trials are computed once (see spike_times_to_rate). Bootstrap means are derived from this
+    matrix by resampling trial indices, block_size draws at a time with one matrix product per block. Every block
+    has its own seed derived from seed, so the result does not depend on n_jobs.
+
+    Peak memory: two (trials x samples) matrices of dtype for the rates and their standard deviation, plus
+    (n_boot + block_size) x samples values for the bootstrap.
+
+    :param spike_trains: list of 1D spike time arrays (one per trial) or a SpikeTrainSet
+    :param sample_rate: The rate, in Hz, in which the rate should be given.
+    :param duration: The duration of the trials in seconds
+    :param kernel_width: the width of the kernel in seconds (the standard deviation of the Gaussian kernel)
+    :param kernel: the name of a kernel shape or a kernel array, see binary_spike_train_to_rate
+    :param n_boot: the number of bootstrap draws, 0 for no confidence bands
+    :param ci: the width of the confidence band in percent
+    :param seed: seed for the bootstrap
+    :param n_jobs: if given, the bootstrap blocks are distributed over n_jobs workers
+    :param backend: 'thread' or 'process' workers. Threads share the rate matrix and are usually sufficient since
+                    the matrix products release the GIL.
+    :param block_size: the number of bootstrap draws per block
+    :param return_metadata: If true a Provenance record of the analysis is returned as well (see provenance.to_odml)
+    :param dtype: floating point type of the rates and the results, e.g. numpy.float32 (default: float64)
+
+    :return: the mean rate, its standard error and the (2 x samples) lower and upper confidence band (None if
+             n_boot is 0), and, if wanted, the metadata.
+    """
+    rates = spike_times_to_rate(_as_train_set(spike_trains), sample_rate, duration, kernel_width, kernel, dtype=dtype)
+    n_trials = len(rates)
+    mean = rates.mean(axis=0)
+    sem = rates.std(axis=0, ddof=1) if n_trials > 1 else np.zeros_like(mean)
+    sem /= np.sqrt(n_trials)
+
+    band = None
+    if n_boot > 0:
+        n_blocks = -(-n_boot // block_size)
+        seeds = np.random.SeedSequence(seed).spawn(n_blocks)
+        n_draws = [block_size] * (n_blocks - 1) + [n_boot - block_size * (n_blocks - 1)]
+        if n_jobs is None or n_jobs < 2:
+            means = _bootstrap_means(rates, seeds, n_draws)
+        else:
+            if backend not in ('thread', 'process'):
+                raise ValueError("backend must be 'thread' or 'process'")
+            groups = np.array_split(np.arange(n_blocks), min(n_jobs, n_blocks))
+            executor = ThreadPoolExecutor if backend == 'thread' else ProcessPoolExecutor
+            with executor(max_workers=n_jobs) as pool:
+                means = np.concatenate(list(pool.map(_bootstrap_means, repeat(rates),
+                                                     [[seeds[i] for i in g] for g in groups],
+                                                     [[n_draws[i] for i in g] for g in groups])))
+        band = np.percentile(means, [(100. - ci) / 2., (100. + ci) / 2.], axis=0).astype(means.dtype, copy=False)
+
+    if not return_metadata:
+        return mean, sem, band
+    name = kernel if isinstance(kernel, str) else "custom"
+    return mean, sem, band, make_provenance('psth', ("KernelWidth", kernel_width, 's'), ("KernelType", name, None),
+                                            ("Trials", n_trials, None), ("Bootstraps", n_boot, None))
+
+
+def _serial_correlation_batch(values, offsets, max_lags, method, out=None, dtype=None):
+    """
+    Serial correlations of all spike trains stored in values with the given offsets. Returns a (trains x max_lags)
+    matrix, lags that are not available for a train (see serial_correlation) are NaN. The intervals are centered and
+    the products of the lags are formed in place in one scratch buffer of the size of the intervals.
+    """
+    n_trains = len(offsets) - 1
+    n_isis = np.maximum(np.diff(offsets) - 1, 0)
+    ids = np.repeat(np.arange(n_trains), n_isis)
+    keep = np.ones(max(len(values) - 1, 0), dtype=bool)
+    keep[offsets[1:-1][(offsets[1:-1] > 0) & (offsets[1:-1] < len(values))] - 1] = False
+    unbiased = np.diff(values)[keep].astype(dtype, copy=False)
+    del keep
+
+    # without any intervals bincount returns integers
+    means = np.bincount(ids, unbiased, minlength=n_trains).astype(np.float64, copy=False)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means /= n_isis
+    buffer = means.astype(unbiased.dtype)[ids]
+    unbiased -= buffer
+    norm = np.bincount(ids, np.multiply(unbiased, unbiased, out=buffer), minlength=n_trains).astype(np.float64,
+                                                                                                     copy=False)
+    available = n_isis - n_isis // 2
+    # no train has more lags than this
+    n_lags = min(max_lags, available.max(initial=0))
+
+    a_corr = _output(out, (n_trains, max_lags), unbiased.dtype)
+    if method == 'auto':
+        # direct costs about 12 ns per interval and lag, fft about 100 ns per interval plus 40 us per train
+        method = 'direct' if n_lags * len(unbiased) <= 8 * len(unbiased) + 3000 * n_trains else 'fft'
+    if method == 'direct':
+        different = np.empty(len(ids), dtype=bool)
+        for lag in range(n_lags):
+            n = len(unbiased) - lag
+            products = np.multiply(unbiased[:n], unbiased[lag:], out=buffer[:n])
+            if lag > 0:
+                # products across the boundary of two trains do not count
+                products[np.not_equal(ids[:n], ids[lag:], out=different[:n])] = 0
+            a_corr[:, lag] = np.bincount(ids[lag:], products, minlength=n_trains)
+    elif method == 'fft':
+        del buffer
+        fft = _fft_module(unbiased.dtype)
+        starts = np.r_[0, np.cumsum(n_isis)]
+        for i in range(n_trains):
+            u = unbiased[starts[i]:starts[i + 1]]
+            if len(u) == 0:
+                continue
+            nfft = _next_fast_len(2 * len(u) - 1)
+            spectrum = fft.rfft(u, nfft)
+            spectrum *= spectrum.conj()
+            corr = fft.irfft(spectrum, nfft)[:min(n_lags, len(u))]
+            a_corr[i, :len(corr)] = corr
+    else:
+        raise ValueError("method must be 'auto', 'direct' or 'fft'")
+    with np.errstate(invalid='ignore', divide='ignore'):
+        a_corr /= norm[:, None]
+    a_corr[np.arange(max_lags) >= available[:, None]] = np.nan
+    return a_corr
+
+
+@instrument
+@cached(version=1)
+def serial_correlation(spike_times, max_lags=50, return_metadata=False, binned=False, method='auto', dtype=None,
+                       out=None):
     """
         Calculate the serial correlation for the the spike train provided by spike_times.
 
-    :param spike_times: the spike times of a single trial. This should be a 1D array.
+        Only the requested lags are computed, either directly (cost proportional to the number of intervals times
+        max_lags) or via FFT, which is faster for many lags. As before, at most half as many lags as there are
+        inter-spike-intervals (rounded up) are returned.
+
+        Several trials or units can be processed at once by passing a list of spike time arrays of different lengths.
+        The result is then a (trials x max_lags) matrix in which lags not available for a trial are NaN.
+
+        Instead of spike times, a binned representation as returned by spike_times_to_binary may be passed. Since the
+        serial correlation does not depend on the unit of the inter-spike-intervals, no sample rate is needed. Packed
+        and sparse inputs are recognized automatically, dense binned arrays must be flagged with binned=True. Binned
+        inputs with more than one row are treated as a batch.
+
+        Peak memory: about n_spikes * (32 + 2 * itemsize) bytes plus the result for method='direct', where itemsize
+        is that of dtype; 'fft' needs up to 10 * itemsize bytes more per interval of the longest train. The spike
+        times themselves are always handled in float64.
+
+    :param spike_times: the spike times of a single trial. This should be a 1D array, or a list of such arrays or a
+                        SpikeTrainSet.
     :param max_lags: The number of lags to take into account
-    :param return_metadata: If true the analysis metadata are returned as odml section
+    :param return_metadata: If true a Provenance record of the analysis is returned as well (see provenance.to_odml)
+    :param binned: If true spike_times is a dense binned representation (binary or spike counts).
+    :param method: 'direct', 'fft' or 'auto' (direct for few available lags or many short trains, fft otherwise)
+    :param dtype: floating point type of the intervals and the result, e.g. numpy.float32 (default: the dtype of
+                  out, or float64)
+    :param out: C-contiguous array the result is written into, of shape (max_lags,) for a single train (the result
+                is then a view of its available lags) or (trials x max_lags) for several trains
 
     :return: the serial correlation as a function of the lag, and, if wanted, the metadata.
 
     """
-    if len(spike_times.shape) > 1:
-        raise ValueError("spike times must not be more than 1D.")
-
-    isis = np.diff(spike_times)
-    unbiased = isis - np.mean(isis, 0)
-    norm = np.sum(unbiased**2)
-    a_corr = np.correlate(unbiased, unbiased, "same")/norm
-    a_corr = a_corr[len(a_corr)/2:]
-
-    if not return_metadata or 'odml' not in globals():
-        return a_corr[:max_lags]
-
-    metadata = odml.Section("Serial correlation", "analysis/serial_correlation")
-    metadata.append(odml.Property("Description", "The serial correlation of inter-spike-intervals."))
-    metadata.append(odml.Property("NoOfLags", max_lags))
-    metadata.append(odml.Property("FirstLagCorrelation", a_corr[1]))
-    metadata.append(odml.Property("Date", dt.date.today().isoformat()))
-    return a_corr[:max_lags], metadata
+    single = True
+    spike_times = _single_train(spike_times)
+    if binned or _is_sparse(spike_times) or isinstance(spike_times, PackedBinary):
+        shape, _, rows, bins, counts = _spike_bins(spike_times)
+        counts = np.asarray(counts, dtype=int)
+        values = np.repeat(bins, counts).astype(float)
+        offsets = np.searchsorted(np.repeat(rows, counts), np.arange(int(np.prod(shape)) + 1))
+        single = len(shape) == 0
+    elif isinstance(spike_times, (SpikeTrainSet, list, tuple)):
+        trains = _as_train_set(spike_times)
+        values, offsets = np.asarray(trains.spike_times, dtype=float), np.asarray(trains.offsets)
+        single = False
+    else:
+        if len(spike_times.shape) > 1:
+            raise ValueError("spike times must not be more than 1D.")
+        values, offsets = np.asarray(spike_times, dtype=float), np.array([0, len(spike_times)])
+
+    if dtype is None:
+        dtype = out.dtype if out is not None else float
+    if single and out is not None:
+        out = out.reshape(1, -1) if out.ndim == 1 and out.flags.c_contiguous else out
+    a_corr = _serial_correlation_batch(values, offsets, max_lags, method, out=out, dtype=dtype)
+    if single:
+        a_corr = a_corr[0, :max(len(values) - 1, 0) - max(len(values) - 1, 0) // 2]
+
+    if not return_metadata:
+        return a_corr
+    return a_corr, make_provenance('serial_correlation', ("NoOfLags", max_lags, None))
@@ -0,0 +1,164 @@
+import os
+import numpy as np
+
+
+class SpikeTrainSet(object):
+    """
+    Ragged collection of spike trains. All spike times are stored in one contiguous array, the spike times of
+    train i are spike_times[offsets[i]:offsets[i + 1]]. Compared to a list of arrays this avoids the per-object
+    overhead, allows vectorized operations over all trains, and the arrays can be memory mapped from .npy files so
+    that loading is zero-copy and worker processes share the data instead of receiving pickled copies.
+    """
+
+    def __init__(self, spike_times, offsets, path=None, mmap_mode=None):
+        """
+        :param spike_times: 1D array with the concatenated spike times of all trains in seconds
+        :param offsets: 1D integer array of length number of trains + 1 with the start of each train in spike_times
+        :param path: the directory the arrays were loaded from, if they are memory mapped
+        :param mmap_mode: the mode the arrays were memory mapped with
+        """
+        self.spike_times = spike_times if isinstance(spike_times, np.memmap) else np.asarray(spike_times)
+        self.offsets = offsets if isinstance(offsets, np.memmap) else np.asarray(offsets, dtype=np.int64)
+        if len(self.spike_times.shape) != 1 or len(self.offsets.shape) != 1:
+            raise ValueError("spike_times and offsets must be 1D arrays.")
+        if len(self.offsets) == 0 or self.offsets[0] != 0 or self.offsets[-1] != len(self.spike_times):
+            raise ValueError("offsets must start at 0 and end at the number of spike times.")
+        self.path = path
+        self.mmap_mode = mmap_mode
+
+    @classmethod
+    def from_list(cls, trains):
+        """
+        Creates a SpikeTrainSet from a list of 1D spike time arrays.
+
+        :param trains: list of 1D arrays
+        :return: the SpikeTrainSet
+        """
+        trains = [np.asarray(train, dtype=float) for train in trains]
+        for train in trains:
+            if len(train.shape) != 1:
+                raise ValueError("a list of spike trains must contain 1D arrays of spike times, got shape %s"
+                                 % (train.shape,))
+        offsets = np.zeros(len(trains) + 1, dtype=np.int64)
+        np.cumsum([len(train) for train in trains], out=offsets[1:])
+        spike_times = np.concatenate(trains) if trains else np.zeros(0)
+        return cls(spike_times, offsets)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Loads a SpikeTrainSet stored with save. By default the arrays are memory mapped read-only.
+
+        :param path: the directory the set was saved to
+        :param mmap_mode: passed to numpy.load, None loads the arrays into memory
+        :return: the SpikeTrainSet
+        """
+        spike_times = np.load(os.path.join(path, 'spike_times.npy'), mmap_mode=mmap_mode)
+        offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode=mmap_mode)
+        if mmap_mode is None:
+            return cls(spike_times, offsets)
+        return cls(spike_times, offsets, path=os.path.abspath(path), mmap_mode=mmap_mode)
+
+    def save(self, path):
+        """
+        Stores the set as spike_times.npy and offsets.npy in the given directory, which is created if needed.
+
+        :param path: the directory
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        np.save(os.path.join(path, 'spike_times.npy'), np.asarray(self.spike_times))
+        np.save(os.path.join(path, 'offsets.npy'), np.asarray(self.offsets, dtype=np.int64))
+
+    def __reduce__(self):
+        if self.path is not None:
+            return self.load, (self.path, self.mmap_mode)
+        return self.__class__, (np.asarray(self.spike_times), np.asarray(self.offsets))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.spike_times[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, item):
+        """
+        An integer returns the spike times of that train as a view, a slice, index or boolean array returns a new
+        SpikeTrainSet with the selected trains.
+        """
+        if isinstance(item, (int, np.integer)):
+            if item < 0:
+                item += len(self)
+            if not 0 <= item < len(self):
+                raise IndexError("spike train index out of range")
+            return self.spike_times[self.offsets[item]:self.offsets[item + 1]]
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step == 1:
+                offsets = self.offsets[start:max(start, stop) + 1]
+                return SpikeTrainSet(self.spike_times[offsets[0]:offsets[-1]], offsets - offsets[0])
+            item = np.arange(start, stop, step)
+        item = np.arange(len(self))[item]
+        counts = self.counts()[item]
+        offsets = np.zeros(len(item) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        positions = np.repeat(self.offsets[item] - offsets[:-1], counts) + np.arange(offsets[-1])
+        return SpikeTrainSet(self.spike_times[positions], offsets)
+
+    def __repr__(self):
+        return "SpikeTrainSet(%i trains, %i spikes)" % (len(self), len(self.spike_times))
+
+    @property
+    def nbytes(self):
+        """
+        :return: the memory used by the spike times and the offsets in bytes
+        """
+        return self.spike_times.nbytes + self.offsets.nbytes
+
+    def counts(self):
+        """
+        :return: the number of spikes of every train
+        """
+        return np.diff(self.offsets)
+
+    def train_index(self):
+        """
+        :return: for every entry of spike_times the index of the train it belongs to
+        """
+        return np.repeat(np.arange(len(self)), self.counts())
+
+    def rates(self, duration):
+        """
+        :param duration: the duration of the trials in seconds
+        :return: the mean firing rate of every train in Hz
+        """
+        return self.counts() / float(duration)
+
+    def isis(self):
+        """
+        :return: the inter-spike-intervals of all trains as SpikeTrainSet
+        """
+        n_isis = np.maximum(self.counts() - 1, 0)
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(n_isis, out=offsets[1:])
+        same = self.train_index()
+        same = same[:-1] == same[1:]
+        return SpikeTrainSet(np.diff(self.spike_times)[same], offsets)
+
+    def restrict(self, t_start, t_stop):
+        """
+        :param t_start: start of the window in seconds (inclusive)
+        :param t_stop: end of the window in seconds (exclusive)
+        :return: a SpikeTrainSet with only the spikes in [t_start, t_stop) of every train
+        """
+        keep = (self.spike_times >= t_start) & (self.spike_times < t_stop)
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.train_index()[keep], minlength=len(self)), out=offsets[1:])
+        return SpikeTrainSet(self.spike_times[keep], offsets)
+
+    def to_list(self):
+        """
+        :return: the spike trains as list of arrays (views into spike_times)
+        """
+        return list(self)
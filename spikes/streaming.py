@@ -0,0 +1,81 @@
+import numpy as np
+from .kernels import get_kernel
+
+
+class StreamingRateEstimator(object):
+    """
+    Estimates the spike rate online from consecutive chunks of data. Only causal kernels can be used, i.e. the
+    rate at a sample depends on the current and past samples only. The estimator keeps the last len(kernel) - 1
+    input samples, so memory is bounded and the work per chunk only depends on the chunk size and kernel length.
+
+    Fed with the complete recording, the concatenated output is the same as that of
+    binary_spike_train_to_rate(binary, sample_rate, kernel_width, kernel=kernel).
+    """
+
+    def __init__(self, sample_rate, kernel_width, kernel='exponential', duration=None):
+        """
+        :param sample_rate: the rate in Hz in which the data are sampled
+        :param kernel_width: the width of the kernel in seconds (time constant or standard deviation)
+        :param kernel: a causal kernel, 'exponential', 'half_gaussian' or 'alpha', or a kernel array centered like
+                       gauss_kernel that is zero before its center
+        :param duration: the duration of the kernel in seconds or None for the default of the kernel shape
+        """
+        if isinstance(kernel, str):
+            kernel = get_kernel(kernel, kernel_width, sample_rate, duration)
+        kernel = np.asarray(kernel, dtype=float)
+        center = (len(kernel) - 1) // 2
+        if np.any(kernel[:center] != 0):
+            raise ValueError("StreamingRateEstimator requires a causal kernel.")
+        self.sample_rate = sample_rate
+        self._taps = kernel[center:] * sample_rate
+        self._history = np.zeros(len(self._taps) - 1)
+        self._n_samples = 0
+
+    @property
+    def n_samples(self):
+        """
+        The number of samples processed since the start of the stream.
+        """
+        return self._n_samples
+
+    def reset(self):
+        """
+        Forgets all past input, the next chunk is treated as the start of a new stream.
+        """
+        self._history[:] = 0
+        self._n_samples = 0
+
+    def process_binary(self, samples):
+        """
+        Processes the next chunk of binary (or spike count) samples.
+
+        :param samples: 1D array with the next samples of the binary representation of the spike train
+
+        :return: the rate for each of the samples as numpy array
+        """
+        samples = np.asarray(samples, dtype=float)
+        if len(samples.shape) > 1:
+            raise ValueError("samples must not have more than one dimension")
+        if len(samples) == 0:
+            return np.zeros(0)
+        data = np.concatenate((self._history, samples))
+        rate = np.convolve(data, self._taps, mode='valid')
+        if len(self._history):
+            self._history = data[-len(self._history):]
+        self._n_samples += len(samples)
+        return rate
+
+    def process_spike_times(self, spike_times, n_samples):
+        """
+        Processes the next chunk given by the spike times that occurred within it.
+
+        :param spike_times: the spike times in seconds, measured from the start of the stream. Spikes outside the
+                            chunk are ignored.
+        :param n_samples: the number of samples the chunk covers
+
+        :return: the rate for each of the samples in the chunk as numpy array
+        """
+        indices = np.asarray(np.asarray(spike_times) * self.sample_rate, dtype=int) - self._n_samples
+        binary = np.zeros(n_samples)
+        binary[indices[(indices >= 0) & (indices < n_samples)]] = 1
+        return self.process_binary(binary)